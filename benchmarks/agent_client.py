@@ -0,0 +1,99 @@
+"""
+Benchmark for the shared KB agent HTTP client.
+
+Starts a local agent stub that answers `/chat/send` after a fixed delay and
+fires N concurrent queries at it, first with a blocking client called from the
+event loop (how `get_query_response` used to work) and then with the shared
+async client from `core.http_client`. With the async client the whole batch
+should finish in about one agent latency.
+
+Usage:
+    python benchmarks/agent_client.py --requests 50 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+STUB_HOST = "127.0.0.1"
+STUB_PORT = 8765
+
+os.environ.setdefault("KB_AGENT_BASE_URL", f"http://{STUB_HOST}:{STUB_PORT}")
+os.environ.setdefault("TELEGRAM_BASE_URL", "http://localhost")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TELEGRAM_BOT_NAME", "benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from core.http_client import init_agent_client, close_agent_client, get_agent_client  # noqa: E402
+from fake_agent import build_app  # noqa: E402
+
+
+def request_body(index: int) -> dict:
+    return {"session_id": str(index), "channel_id": "telegram", "text": f"question {index}",
+            "language": "en", "audio": ""}
+
+
+async def run_blocking(count: int) -> float:
+    """Blocking client on the event loop, as the handlers did before."""
+    with httpx.Client(base_url=os.environ["KB_AGENT_BASE_URL"]) as client:
+        async def query(index: int) -> None:
+            client.post("/chat/send", json=request_body(index)).raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(query(i) for i in range(count)))
+        return time.perf_counter() - started
+
+
+async def run_async(count: int) -> float:
+    """Shared pooled async client."""
+    await init_agent_client()
+    try:
+        client = get_agent_client()
+
+        async def query(index: int) -> None:
+            (await client.post("/chat/send", json=request_body(index))).raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(query(i) for i in range(count)))
+        return time.perf_counter() - started
+    finally:
+        await close_agent_client()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="number of concurrent queries")
+    parser.add_argument("--latency", type=float, default=0.5, help="agent stub latency in seconds")
+    parser.add_argument("--skip-blocking", action="store_true", help="only run the async client")
+    args = parser.parse_args()
+
+    # The stub runs on its own thread and event loop so the blocking run can't stall it.
+    server = uvicorn.Server(uvicorn.Config(app=build_app(args.latency), host=STUB_HOST, port=STUB_PORT,
+                                           log_level="warning"))
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    try:
+        print(f"{args.requests} concurrent queries, agent latency {args.latency:.3f}s")
+        if not args.skip_blocking:
+            elapsed = await run_blocking(args.requests)
+            print(f"  blocking client : {elapsed:7.3f}s ({elapsed / args.latency:5.1f}x agent latency)")
+        elapsed = await run_async(args.requests)
+        print(f"  async client    : {elapsed:7.3f}s ({elapsed / args.latency:5.1f}x agent latency)")
+    finally:
+        server.should_exit = True
+        server_thread.join()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Stand-in for the KB agent API, for local benchmarks and manual testing.
+
+Serves `POST /chat/send`, which answers with JSON after `--latency` seconds,
+and `POST /chat/stream`, which streams the same answer as server-sent events,
+one word per event and `--token-delay` seconds apart.
+
+`--distribution` draws every latency around `--latency` instead of using it
+as is: "uniform" between 0.5x and 1.5x, "exponential" with that mean, or
+"lognormal" with that median and a long tail. With `--audio-ratio` that share
+of answers links to an audio file served by `GET /audio/<n>.ogg`. Queries are
+taken as JSON or, as the bot sends them with `AGENT_AUDIO_UPLOAD`, as
+multipart/form-data with the recording attached.
+
+Usage:
+    python benchmarks/fake_agent.py --port 8765 --latency 2 --token-delay 0.05
+    KB_AGENT_BASE_URL=http://127.0.0.1:8765 AGENT_STREAMING_ENABLED=true python src/main.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from typing import Callable
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from fake_telegram import read_parameters
+
+ANSWER = ("Karma points are awarded for learning activities on iGOT Karmayogi. You earn them by completing "
+          "courses, rating courses you completed and taking part in discussions. Your total is shown on "
+          "your profile page.")
+
+
+DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+AUDIO_SIZE = 32 * 1024
+
+
+def latency_sampler(latency: float, distribution: str = "fixed") -> Callable[[], float]:
+    """Returns a function drawing latencies of the given distribution around `latency`."""
+    if distribution == "uniform":
+        return lambda: random.uniform(0.5 * latency, 1.5 * latency)
+    if distribution == "exponential":
+        return lambda: random.expovariate(1 / latency) if latency > 0 else 0.0
+    if distribution == "lognormal":
+        # Median `latency`, p99 at roughly 4x the median
+        return lambda: random.lognormvariate(0, 0.6) * latency
+    return lambda: latency
+
+
+def build_app(latency: float = 1.0, token_delay: float = 0.05, answer: str = ANSWER, distribution: str = "fixed",
+              audio_ratio: float = 0.0, public_url: str = "http://127.0.0.1:8765") -> Starlette:
+    sample_latency = latency_sampler(latency, distribution)
+    audio_ids = itertools.count()
+    audio_data = bytes(AUDIO_SIZE)
+
+    def audio_url() -> str:
+        return f"{public_url}/audio/{next(audio_ids)}.ogg" if random.random() < audio_ratio else ""
+
+    async def chat_send(request: Request) -> JSONResponse:
+        body = await read_parameters(request)
+        await asyncio.sleep(sample_latency())
+        return JSONResponse({"text": answer, "audio": audio_url(), "language": body.get("language")})
+
+    async def audio(_: Request) -> Response:
+        return Response(audio_data, media_type="audio/ogg")
+
+    async def chat_stream(request: Request) -> StreamingResponse:
+        await read_parameters(request)
+
+        async def events():
+            await asyncio.sleep(sample_latency())
+            for index, word in enumerate(answer.split(" ")):
+                yield f"data: {json.dumps({'text': word if index == 0 else ' ' + word})}\n\n"
+                await asyncio.sleep(token_delay)
+            url = audio_url()
+            if url:
+                yield f"data: {json.dumps({'audio': url})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[
+        Route("/chat/send", chat_send, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/audio/{name}", audio, methods=["GET"]),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds before the answer (or first token)")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="seconds between streamed tokens")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed", help="latency distribution")
+    parser.add_argument("--audio-ratio", type=float, default=0.0, help="share of answers with an audio URL")
+    args = parser.parse_args()
+    app = build_app(args.latency, args.token_delay, distribution=args.distribution, audio_ratio=args.audio_ratio,
+                    public_url=f"http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Stand-in for the Telegram Bot API, for load tests and manual testing.
+
+Answers every `POST /bot<token>/<method>` the bot makes, records each call
+and, with `--error-rate`, rejects that share of the message sending calls
+with `429 Too Many Requests` and `--retry-after` seconds. `GET /calls`
+reports the recorded call counts. Updates queued with `add_update` are
+served by `getUpdates`, for bots in long polling mode.
+
+Usage:
+    python benchmarks/fake_telegram.py --port 8081 --error-rate 0.01
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot \\
+        TELEGRAM_API_BASE_FILE_URL=http://127.0.0.1:8081/file/bot python src/main.py
+"""
+import argparse
+import asyncio
+import email.parser
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Calls that send or change messages, the ones Telegram rate limits
+SENDING_METHODS = frozenset({"sendMessage", "sendVoice", "sendAudio", "editMessageText", "editMessageReplyMarkup"})
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+
+async def read_parameters(request: Request) -> Dict[str, str]:
+    """Parses the form, multipart or JSON body of a Bot API call into plain string parameters."""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return {key: value if isinstance(value, str) else json.dumps(value)
+                for key, value in (json.loads(body or b"{}")).items()}
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        parameters = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                parameters[name] = part.get_payload(decode=True).decode("utf-8")
+        return parameters
+    return dict(parse_qsl(body.decode("utf-8")))
+
+
+class FakeTelegram:
+    """Records the Bot API calls of the bot and answers them like Telegram would."""
+
+    def __init__(self, error_rate: float = 0.0, retry_after: int = 1,
+                 on_call: Optional[Callable[[str, Dict[str, str]], None]] = None):
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.on_call = on_call
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        # Updates not confirmed by the bot yet, in order of update_id
+        self.updates: List[dict] = []
+        self._update_added = asyncio.Event()
+        self.webhook = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+
+    def add_update(self, update: dict) -> None:
+        self.updates.append(update)
+        self._update_added.set()
+
+    def release_polls(self) -> None:
+        """Answers the long polls still waiting, e.g. those a stopped bot left behind, so the server can stop."""
+        self._update_added.set()
+
+    async def get_updates(self, parameters: Dict[str, str]) -> List[dict]:
+        """Like Telegram: confirms the updates below `offset`, long polls for up to `timeout` seconds."""
+        offset = int(parameters.get("offset") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and int(parameters.get("timeout") or 0) > 0:
+            self._update_added.clear()
+            try:
+                await asyncio.wait_for(self._update_added.wait(), int(parameters["timeout"]))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(parameters.get("limit") or 100)]
+
+    def _message(self, parameters: Dict[str, str], **fields) -> dict:
+        chat_id = parameters.get("chat_id", "0")
+        message = {
+            "message_id": int(parameters.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "private"},
+        }
+        if "text" in parameters:
+            message["text"] = parameters["text"]
+        message.update(fields)
+        return message
+
+    def result(self, method: str, parameters: Dict[str, str]):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self._message(parameters)
+        if method in ("sendVoice", "sendAudio"):
+            file_id = f"voice-{next(self._message_ids)}"
+            return self._message(parameters, voice={"file_id": file_id, "file_unique_id": file_id, "duration": 1})
+        if method == "getFile":
+            file_id = parameters.get("file_id", "file")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": 1024,
+                    "file_path": f"voice/{file_id}.oga"}
+        if method == "getWebhookInfo":
+            return self.webhook
+        if method == "setWebhook":
+            self.webhook = {**self.webhook, "url": parameters.get("url", "")}
+            if "allowed_updates" in parameters:
+                self.webhook["allowed_updates"] = json.loads(parameters["allowed_updates"])
+        elif method == "deleteWebhook":
+            self.webhook = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    async def handle(self, request: Request) -> Response:
+        method = request.path_params["method"]
+        parameters = await read_parameters(request)
+        if method in SENDING_METHODS and self.error_rate and random.random() < self.error_rate:
+            self.rejected[method] += 1
+            return JSONResponse({"ok": False, "error_code": 429,
+                                 "description": f"Too Many Requests: retry after {self.retry_after}",
+                                 "parameters": {"retry_after": self.retry_after}}, status_code=429)
+        self.calls[method] += 1
+        if self.on_call:
+            self.on_call(method, parameters)
+        if method == "getUpdates":
+            return JSONResponse({"ok": True, "result": await self.get_updates(parameters)})
+        return JSONResponse({"ok": True, "result": self.result(method, parameters)})
+
+    async def file(self, _: Request) -> Response:
+        return Response(bytes(1024), media_type="audio/ogg")
+
+    async def report(self, _: Request) -> JSONResponse:
+        return JSONResponse(self.stats())
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "rejected_429": dict(self.rejected)}
+
+    def build_app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/bot{token}/{method}", self.handle, methods=["POST", "GET"]),
+            Route("/file/bot{token}/{path:path}", self.file, methods=["GET"]),
+            Route("/calls", self.report, methods=["GET"]),
+        ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of sending calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of the injected 429s")
+    args = parser.parse_args()
+    telegram = FakeTelegram(args.error_rate, args.retry_after)
+    uvicorn.run(telegram.build_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
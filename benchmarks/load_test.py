@@ -0,0 +1,386 @@
+"""
+End-to-end load test of the webhook bot against local stand-ins.
+
+Starts the fake Telegram Bot API (`fake_telegram.py`) and the fake KB agent
+(`fake_agent.py`) in this process, launches `src/main.py` pointed at them and
+posts synthetic webhook updates to its `/telegram` route at `--rate` updates
+per second: text and voice questions and feedback button presses, from
+`--users` chats spread over all bot languages. Redis must be reachable with
+the usual `REDIS_*` settings.
+
+An update counts as answered when the bot delivers its final reply: the
+answer carrying the feedback keyboard for questions (which also answers the
+earlier questions of the chat the bot merged into it), `answerCallbackQuery`
+for button presses. The report lists throughput, p50/p95/p99 end-to-end
+latency per update kind, webhook status codes, Bot API calls and the bot's
+resident memory. `--max-p95` makes the run fail when p95 is exceeded, to
+catch regressions before a deploy. With `--ingress polling` the bot runs in
+long polling mode and fetches the updates from the fake Bot API instead.
+
+Usage:
+    python benchmarks/load_test.py --rate 50 --duration 30 --agent-latency 1 --distribution lognormal
+    python benchmarks/load_test.py --env CONCURRENT_UPDATES=64 --env CONNECTION_POOL_SIZE=128 --json result.json
+    python benchmarks/load_test.py --ingress polling --rate 50 --duration 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+from fake_agent import DISTRIBUTIONS, build_app as build_agent_app
+from fake_telegram import FakeTelegram
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+LANGUAGES = sorted(path.stem for path in (ROOT_DIR / "src" / "languages").glob("*.json"))
+QUESTIONS = [
+    "How to earn Karma points?",
+    "I want to update my registered mobile number",
+    "My certificate is not generated.",
+    "How many courses have I completed?",
+    "कर्मा पॉइंट कैसे कमाएँ?",
+    "मेरा प्रमाणपत्र जेनरेट नहीं हुआ है।",
+]
+KINDS = ("text", "voice", "callback")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown update kind {kind!r}, expected one of {KINDS}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def read_rss(pid: int) -> Optional[int]:
+    """Resident memory of a process in bytes, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class UpdateFactory:
+    """Builds raw webhook updates with ids that the replies can be matched against."""
+
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+
+    @staticmethod
+    def _chat(chat_id: int) -> Tuple[dict, dict]:
+        name = f"user{chat_id}"
+        return {"id": chat_id, "type": "private", "first_name": name}, {"id": chat_id, "is_bot": False,
+                                                                          "first_name": name}
+
+    def message(self, chat_id: int, voice: bool) -> Tuple[str, dict]:
+        chat, user = self._chat(chat_id)
+        message_id = next(self.message_ids)
+        message = {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": user}
+        if voice:
+            file_id = f"voice-question-{message_id}"
+            message["voice"] = {"file_id": file_id, "file_unique_id": file_id, "duration": 3,
+                                "mime_type": "audio/ogg"}
+        else:
+            message["text"] = random.choice(QUESTIONS)
+        return f"message:{message_id}", {"update_id": next(self.update_ids), "message": message}
+
+    def callback(self, chat_id: int, data: str) -> Tuple[str, dict]:
+        chat, user = self._chat(chat_id)
+        callback_id = str(next(self.callback_ids))
+        callback_query = {"id": callback_id, "from": user, "chat_instance": str(chat_id), "data": data,
+                          "message": {"message_id": next(self.message_ids), "date": int(time.time()),
+                                      "chat": chat, "text": "answer"}}
+        return f"callback:{callback_id}", {"update_id": next(self.update_ids), "callback_query": callback_query}
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.updates = UpdateFactory()
+        self.telegram = FakeTelegram(args.error_rate, args.retry_after, on_call=self.on_call)
+        self.pending: Dict[str, Tuple[str, float, int]] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.webhook_statuses: Counter = Counter()
+        self.completed = asyncio.Event()
+        self.last_answer_at = 0.0
+        self.rss_samples: List[int] = []
+        self.bot: Optional[subprocess.Popen] = None
+        # Posted like Telegram does, so the run goes through the bot's secret token check
+        bot_env = dict(item.split("=", 1) for item in args.env)
+        self.secret_token = bot_env.get("WEBHOOK_SECRET_TOKEN", os.environ.get("WEBHOOK_SECRET_TOKEN") or "benchmark")
+
+    def on_call(self, method: str, parameters: Dict[str, str]) -> None:
+        """Matches the final reply to an update with the time the update was posted."""
+        keys = []
+        if method == "answerCallbackQuery":
+            keys.append(f"callback:{parameters.get('callback_query_id')}")
+        elif method in ("sendMessage", "editMessageText") and "message-liked__" in parameters.get("reply_markup", ""):
+            message_id = int(parameters["reply_markup"].split("message-liked__", 1)[1].split('"', 1)[0])
+            chat_id = int(parameters.get("chat_id", 0))
+            # Messages the bot coalesced into this answer are answered by it as well
+            keys.extend(key for key, (_, _, pending_chat_id) in self.pending.items()
+                        if pending_chat_id == chat_id and key.startswith("message:")
+                        and int(key.split(":", 1)[1]) <= message_id)
+        answered_at = time.monotonic()
+        for key in keys:
+            entry = self.pending.pop(key, None)
+            if entry is None:
+                continue
+            kind, posted_at, _ = entry
+            self.last_answer_at = answered_at
+            self.latencies[kind].append(answered_at - posted_at)
+        if not self.pending:
+            self.completed.set()
+
+    async def post(self, client: httpx.AsyncClient, kind: str, key: str, update: dict) -> None:
+        payload = update.get("message") or update.get("callback_query") or {}
+        chat_id = (payload.get("chat") or payload.get("message", {}).get("chat", {})).get("id")
+        self.pending[key] = (kind, time.monotonic(), chat_id)
+        self.completed.clear()
+        if self.args.ingress == "polling":
+            self.telegram.add_update(update)
+            self.webhook_statuses["polled"] += 1
+            return
+        try:
+            response = await client.post("/telegram", json=update)
+            self.webhook_statuses[response.status_code] += 1
+            accepted = response.status_code == 200
+        except httpx.HTTPError as e:
+            self.webhook_statuses[type(e).__name__] += 1
+            accepted = False
+        if not accepted:
+            self.pending.pop(key, None)
+            if not self.pending:
+                self.completed.set()
+
+    async def wait_for_answers(self, timeout: float) -> None:
+        if not self.pending:
+            return
+        try:
+            await asyncio.wait_for(self.completed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def next_update(self, users: List[int]) -> Tuple[str, str, dict]:
+        kinds, weights = zip(*self.args.mix.items())
+        kind = random.choices(kinds, weights)[0]
+        chat_id = random.choice(users)
+        if kind == "callback":
+            key, update = self.updates.callback(chat_id, random.choice(("message-liked__1", "message-disliked__1")))
+        else:
+            key, update = self.updates.message(chat_id, voice=kind == "voice")
+        return kind, key, update
+
+    async def sample_memory(self) -> None:
+        while self.bot is not None:
+            rss = read_rss(self.bot.pid)
+            if rss:
+                self.rss_samples.append(rss)
+            await asyncio.sleep(0.5)
+
+    def start_bot(self) -> None:
+        args = self.args
+        env = dict(os.environ)
+        env.update({
+            "KB_AGENT_BASE_URL": f"http://127.0.0.1:{args.agent_port}",
+            "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{args.telegram_port}/bot",
+            "TELEGRAM_API_BASE_FILE_URL": f"http://127.0.0.1:{args.telegram_port}/file/bot",
+            "TELEGRAM_BASE_URL": args.bot_url,
+            "TELEGRAM_BOT_TOKEN": "0:benchmark",
+            "TELEGRAM_BOT_NAME": "benchmark",
+            "LOG_LEVEL": "WARNING",
+            "WEBHOOK_SECRET_TOKEN": self.secret_token,
+        })
+        if args.ingress == "polling":
+            env["SERVING_MODE"] = "polling"
+        env.update(item.split("=", 1) for item in args.env)
+        self.bot = subprocess.Popen([sys.executable, *args.bot_command], cwd=ROOT_DIR, env=env)
+
+    async def wait_for_bot(self, client: httpx.AsyncClient, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.bot is not None and self.bot.poll() is not None:
+                raise RuntimeError(f"bot exited with code {self.bot.returncode}")
+            try:
+                if (await client.get("/healthcheck")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"bot did not come up on {self.args.bot_url} within {timeout}s")
+
+    async def run(self) -> dict:
+        args = self.args
+        servers = [
+            uvicorn.Server(uvicorn.Config(self.telegram.build_app(), host="127.0.0.1", port=args.telegram_port,
+                                          log_level="warning")),
+            uvicorn.Server(uvicorn.Config(
+                build_agent_app(args.agent_latency, args.token_delay, distribution=args.distribution,
+                                audio_ratio=args.audio_ratio, public_url=f"http://127.0.0.1:{args.agent_port}"),
+                host="127.0.0.1", port=args.agent_port, log_level="warning")),
+        ]
+        server_tasks = [asyncio.create_task(server.serve()) for server in servers]
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        memory_task = None
+        try:
+            async with httpx.AsyncClient(base_url=args.bot_url, limits=limits, timeout=30,
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": self.secret_token}) as client:
+                if not args.no_spawn:
+                    self.start_bot()
+                    memory_task = asyncio.create_task(self.sample_memory())
+                await self.wait_for_bot(client)
+
+                # Every chat picks a language first, so the run covers all of them
+                users = [100000 + index for index in range(args.users)]
+                await asyncio.gather(*(
+                    self.post(client, "setup", *self.updates.callback(chat_id, f"lang_{LANGUAGES[index % len(LANGUAGES)]}"))
+                    for index, chat_id in enumerate(users)))
+                await self.wait_for_answers(args.timeout)
+                self.latencies.pop("setup", None)
+                self.pending.clear()
+                self.telegram.calls.clear()
+                self.webhook_statuses.clear()
+                rss_before = self.rss_samples[-1] if self.rss_samples else None
+
+                total = int(args.rate * args.duration)
+                started_at = time.monotonic()
+                posts = []
+                for index in range(total):
+                    delay = started_at + index / args.rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    kind, key, update = self.next_update(users)
+                    posts.append(asyncio.create_task(self.post(client, kind, key, update)))
+                await asyncio.gather(*posts)
+                sent_for = time.monotonic() - started_at
+                await self.wait_for_answers(args.timeout)
+                try:
+                    bot_stats = (await client.get("/stats")).json()
+                except (httpx.HTTPError, ValueError):
+                    bot_stats = None
+        finally:
+            if self.bot is not None:
+                self.bot.terminate()
+                try:
+                    # In a thread, the fake Bot API keeps serving the bot while it shuts down
+                    await asyncio.to_thread(self.bot.wait, 10)
+                except subprocess.TimeoutExpired:
+                    self.bot.kill()
+                self.bot = None
+            if memory_task is not None:
+                await asyncio.gather(memory_task, return_exceptions=True)
+            self.telegram.release_polls()
+            for server in servers:
+                server.should_exit = True
+            await asyncio.gather(*server_tasks, return_exceptions=True)
+
+        answered = sum(len(values) for values in self.latencies.values())
+        elapsed = max(self.last_answer_at - started_at, sent_for)
+        return {
+            "offered_rate": args.rate,
+            "sent": total,
+            "sent_rate": total / sent_for if sent_for else None,
+            "answered": answered,
+            "unanswered": len(self.pending),
+            "throughput": answered / elapsed if elapsed else None,
+            "latency": {
+                kind: {"count": len(values), "p50": percentile(sorted(values), 0.50),
+                       "p95": percentile(sorted(values), 0.95), "p99": percentile(sorted(values), 0.99),
+                       "max": max(values)}
+                for kind, values in self.latencies.items() if values
+            },
+            "all_p95": percentile(sorted(itertools.chain(*self.latencies.values())), 0.95),
+            "webhook_statuses": {str(status): count for status, count in self.webhook_statuses.items()},
+            "telegram": self.telegram.stats(),
+            "memory": {"rss_before": rss_before,
+                       "rss_peak": max(self.rss_samples) if self.rss_samples else None,
+                       "rss_end": self.rss_samples[-1] if self.rss_samples else None},
+            "bot_stats": bot_stats,
+        }
+
+
+def print_report(result: dict) -> None:
+    def seconds(value: Optional[float]) -> str:
+        return f"{value:8.3f}s" if value is not None else "       -"
+
+    def megabytes(value: Optional[int]) -> str:
+        return f"{value / 2 ** 20:.1f} MiB" if value else "-"
+
+    print(f"sent        {result['sent']} updates at {result['sent_rate']:.1f}/s (offered {result['offered_rate']}/s)")
+    print(f"answered    {result['answered']}, unanswered {result['unanswered']}")
+    print(f"throughput  {result['throughput']:.1f} updates/s")
+    print(f"{'kind':10} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for kind, latency in result["latency"].items():
+        print(f"{kind:10} {latency['count']:6d} {seconds(latency['p50'])} {seconds(latency['p95'])} "
+              f"{seconds(latency['p99'])} {seconds(latency['max'])}")
+    print(f"webhook     {result['webhook_statuses']}")
+    print(f"bot api     {result['telegram']['calls']}, injected 429s {result['telegram']['rejected_429']}")
+    memory = result["memory"]
+    print(f"memory      before {megabytes(memory['rss_before'])}, peak {megabytes(memory['rss_peak'])}, "
+          f"end {megabytes(memory['rss_end'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=20, help="updates per second posted to the webhook")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--users", type=int, default=200, help="number of distinct chats")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=0.7,voice=0.2,callback=0.1"),
+                        help="weights of the update kinds, e.g. text=0.7,voice=0.2,callback=0.1")
+    parser.add_argument("--agent-latency", type=float, default=1.0, help="agent latency (median or mean)")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="delay between streamed tokens")
+    parser.add_argument("--audio-ratio", type=float, default=0.1, help="share of answers with audio")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Bot API sends rejected with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for answers after the load")
+    parser.add_argument("--connections", type=int, default=100, help="concurrent webhook connections")
+    parser.add_argument("--ingress", choices=("webhook", "polling"), default="webhook",
+                        help="post updates to the webhook, or queue them for the bot's getUpdates calls")
+    parser.add_argument("--bot-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--bot-command", nargs="+", default=["src/main.py"], help="bot entry point and arguments")
+    parser.add_argument("--no-spawn", action="store_true",
+                        help="use an already running bot, started with the fake endpoints configured")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--agent-port", type=int, default=8765)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="setting passed to the bot, e.g. CONCURRENT_UPDATES=64")
+    parser.add_argument("--json", help="also write the result to this file")
+    parser.add_argument("--max-p95", type=float, help="exit with an error if p95 latency exceeds this many seconds")
+    args = parser.parse_args()
+
+    result = asyncio.run(LoadTest(args).run())
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    if args.max_p95 is not None and (result["all_p95"] is None or result["all_p95"] > args.max_p95):
+        print(f"FAIL: p95 {result['all_p95']} exceeds {args.max_p95}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Cold-start benchmark of the bot.
+
+Measures, over `--runs` fresh processes each:
+
+- import: seconds to import `src/main.py` and the module of the serving
+  mode with everything they pull in, on top of a bare interpreter start. `--top` lists the slowest imports of the
+  last run, from `python -X importtime`.
+- boot: seconds from spawning the bot against the fake Telegram Bot API
+  (`fake_telegram.py`, started in this process) until `/healthcheck`
+  answers (live) and until `/readyz` answers `200` (ready), and from
+  SIGTERM until the process exited. The Bot API calls of each boot are
+  counted, so a restart that registers the webhook again shows up as a
+  `setWebhook`. The webhook registration is remembered in Redis, which must
+  be reachable with the usual `REDIS_*` settings.
+
+`--max-ready` makes the run fail when the median time to ready is exceeded,
+to catch startup regressions before a deploy.
+
+Usage:
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --env SERVING_MODE=polling --json startup.json --max-ready 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from fake_telegram import FakeTelegram
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SRC_DIR = ROOT_DIR / "src"
+# `main.py` imports the module of the configured serving mode only when run
+SERVING_MODULES = {"multiprocess": "supervisor", "polling": "poller"}
+IMPORT_SCRIPT = "import time; started_at = time.perf_counter(); import {}; print(time.perf_counter() - started_at)"
+
+
+def bot_env(args: argparse.Namespace) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "KB_AGENT_BASE_URL": "http://127.0.0.1:9",
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{args.telegram_port}/bot",
+        "TELEGRAM_API_BASE_FILE_URL": f"http://127.0.0.1:{args.telegram_port}/file/bot",
+        "TELEGRAM_BASE_URL": args.bot_url,
+        "TELEGRAM_BOT_TOKEN": "0:benchmark",
+        "TELEGRAM_BOT_NAME": "benchmark",
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(item.split("=", 1) for item in args.env)
+    return env
+
+
+def measure_imports(args: argparse.Namespace) -> dict:
+    """Import time of the bot in fresh interpreters, and the slowest imports of the last one."""
+    env = bot_env(args)
+    imported = f"main, {SERVING_MODULES.get(env.get('SERVING_MODE'), 'server')}"
+    seconds: List[float] = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(imported)], cwd=SRC_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        seconds.append(float(output.split()[-1]))
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {imported}"], cwd=SRC_DIR, env=env,
+                           capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in trace.splitlines():
+        # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+        _, _, fields = line.partition("import time:")
+        parts = fields.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            depth = (len(name) - len(name.lstrip())) // 2
+            modules.append((int(parts[1]) / 1e6, depth, name.strip()))
+    top_level = sorted((module for module in modules if module[1] == 1), reverse=True)
+    return {"seconds": seconds, "top": [{"module": name, "seconds": cumulative}
+                                        for cumulative, _, name in top_level[:args.top]]}
+
+
+async def wait_until(client: httpx.AsyncClient, path: str, started_at: float, bot: subprocess.Popen,
+                     timeout: float) -> Optional[float]:
+    while time.monotonic() - started_at < timeout:
+        if bot.poll() is not None:
+            raise RuntimeError(f"bot exited with code {bot.returncode}")
+        try:
+            if (await client.get(path)).status_code == 200:
+                return time.monotonic() - started_at
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.02)
+    return None
+
+
+async def measure_boots(args: argparse.Namespace) -> List[dict]:
+    """Boots the bot `runs` times against one fake Bot API, which keeps the webhook between boots."""
+    telegram = FakeTelegram()
+    server = uvicorn.Server(uvicorn.Config(telegram.build_app(), host="127.0.0.1", port=args.telegram_port,
+                                           log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    boots = []
+    try:
+        while not server.started:
+            await asyncio.sleep(0.05)
+        async with httpx.AsyncClient(base_url=args.bot_url, timeout=1) as client:
+            for _ in range(args.runs):
+                calls_before = Counter(telegram.calls)
+                started_at = time.monotonic()
+                bot = subprocess.Popen([sys.executable, *args.bot_command], cwd=ROOT_DIR, env=bot_env(args))
+                try:
+                    live = await wait_until(client, "/healthcheck", started_at, bot, args.timeout)
+                    ready = await wait_until(client, "/readyz", started_at, bot, args.timeout)
+                finally:
+                    stopping_at = time.monotonic()
+                    bot.terminate()
+                    try:
+                        # In a thread, the fake Bot API keeps serving the bot while it shuts down
+                        await asyncio.to_thread(bot.wait, 30)
+                    except subprocess.TimeoutExpired:
+                        bot.kill()
+                    stopped = time.monotonic() - stopping_at
+                boots.append({"live": live, "ready": ready, "shutdown": stopped,
+                              "bot_api": dict(Counter(telegram.calls) - calls_before)})
+    finally:
+        telegram.release_polls()
+        server.should_exit = True
+        await asyncio.gather(server_task, return_exceptions=True)
+    return boots
+
+
+def summary(values: List[Optional[float]]) -> str:
+    measured = [value for value in values if value is not None]
+    if not measured:
+        return "n/a"
+    return f"median {statistics.median(measured):.3f}s  min {min(measured):.3f}s  max {max(measured):.3f}s"
+
+
+def print_report(result: dict) -> None:
+    print(f"import      {summary(result['imports']['seconds'])}")
+    for module in result["imports"]["top"]:
+        print(f"            {module['seconds']:.3f}s  {module['module']}")
+    boots = result["boots"]
+    for name in ("live", "ready", "shutdown"):
+        print(f"{name:<12}{summary([boot[name] for boot in boots])}")
+    for index, boot in enumerate(boots, 1):
+        print(f"boot {index:<7}bot api {boot['bot_api']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    parser.add_argument("--bot-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--bot-command", nargs="+", default=["src/main.py"],
+                        help="command that starts the bot, run with this interpreter")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment variable for the bot, may be repeated")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the bot to get ready")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-ready", type=float, help="fail when the median time to ready exceeds this")
+    args = parser.parse_args()
+
+    result = {"imports": measure_imports(args), "boots": asyncio.run(measure_boots(args))}
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    ready = [boot["ready"] for boot in result["boots"]]
+    if args.max_ready is not None and (None in ready or statistics.median(ready) > args.max_ready):
+        sys.exit(f"median time to ready above {args.max_ready}s")
+
+
+if __name__ == "__main__":
+    main()
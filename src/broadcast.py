@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Broadcasts an announcement to every user of the bot.
+
+The announcement is a message key of the language files, so each user gets
+it in their preferred language. `start` only records the broadcast in Redis;
+one of the running bot processes picks it up and sends it, throttled and at
+the lowest outbound priority so answers to users always go first. Progress
+is checkpointed in Redis, so a broadcast interrupted by a restart resumes
+where it stopped, on whichever bot process takes it over.
+
+Usage:
+    python src/broadcast.py start <message_key>
+    python src/broadcast.py status
+    python src/broadcast.py cancel
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Dict, List, Optional, Set
+
+from telegram import Bot
+from telegram.error import Forbidden, TelegramError
+
+from core.config import settings
+from core.logger import logger
+from core.admission import admission
+from core.rate_limiter import Priority, TokenBucket
+from memory.redis import close_redis, redis_client
+from memory.session import INSTANCE_ID, LANGUAGE_KEY_SUFFIX
+from utils.language_util import default_lang, get_message, language_init
+
+LEASE_KEY_SUFFIX = ":lease"
+COUNTERS = ("sent", "blocked", "failed")
+
+
+def _decode(state: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {key.decode('utf-8'): value.decode('utf-8') for key, value in state.items()}
+
+
+async def get_broadcast() -> Dict[str, str]:
+    """The state of the current or last broadcast, empty if there never was one."""
+    return _decode(await redis_client.hgetall(settings.BROADCAST_KEY))
+
+
+class Broadcaster:
+    """
+    Sends the running broadcast, from whichever bot process holds its lease.
+
+    Recipients are streamed page by page with SCAN over the `<chat_id>_language`
+    keys, with their languages fetched in the same round trip, so the user base
+    is never loaded at once. Sends go out at most `rate` per second and
+    `concurrency` at a time as `Priority.BULK` requests, which the rate limiter
+    hands out only when no answer is waiting, and pause while this process is
+    above its admission soft watermark. The SCAN cursor and counters are
+    checkpointed after every page; after a restart the page in progress is sent
+    again, so a user may rarely get the announcement twice but never misses it.
+    """
+
+    def __init__(self, rate: float = settings.BROADCAST_RATE_PER_SECOND,
+                 concurrency: int = settings.BROADCAST_CONCURRENCY,
+                 scan_count: int = settings.BROADCAST_SCAN_COUNT,
+                 lease_ttl: int = settings.BROADCAST_LEASE_TTL,
+                 poll_interval: float = settings.BROADCAST_POLL_INTERVAL):
+        self.scan_count = scan_count
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._bucket = TokenBucket(rate, 1)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.broadcast_id: Optional[str] = None
+        self._lease_lost = False
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.pages = 0
+        self.yielded = 0
+
+    @property
+    def lease_key(self) -> str:
+        return settings.BROADCAST_KEY + LEASE_KEY_SUFFIX
+
+    async def run(self, bot: Bot) -> None:
+        """Checks for a broadcast to send every `poll_interval` seconds, until cancelled."""
+        while True:
+            try:
+                state = await self._claim()
+                if state:
+                    try:
+                        await self._fan_out(bot, state)
+                    finally:
+                        self.broadcast_id = None
+                        await self._release()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Redis unreachable or the like; the checkpoint is where the next attempt resumes
+                logger.error({"category": "broadcast", "label": "broadcast_failed", "value": str(e)})
+            await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self) -> Optional[Dict[str, str]]:
+        """Returns the running broadcast if this process got its lease."""
+        state = await get_broadcast()
+        if state.get("status") != "running":
+            return None
+        if not await redis_client.set(self.lease_key, INSTANCE_ID, nx=True, ex=self.lease_ttl):
+            return None
+        return state
+
+    async def _hold_lease(self) -> None:
+        """Extends the lease while the broadcast is sent, until it expired and another process took it over."""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            owner = await redis_client.get(self.lease_key)
+            if owner is not None and owner.decode('utf-8') != INSTANCE_ID:
+                self._lease_lost = True
+                return
+            await redis_client.set(self.lease_key, INSTANCE_ID, ex=self.lease_ttl)
+
+    async def _release(self) -> None:
+        if await redis_client.get(self.lease_key) == INSTANCE_ID.encode('utf-8'):
+            await redis_client.delete(self.lease_key)
+
+    async def _fan_out(self, bot: Bot, state: Dict[str, str]) -> None:
+        self.broadcast_id = state["id"]
+        message_key = state["message_key"]
+        cursor = int(state.get("cursor") or 0)
+        logger.info({"category": "broadcast", "label": "broadcast_resumed" if cursor else "broadcast_started",
+                     "value": self.broadcast_id, "message_key": message_key})
+        self._lease_lost = False
+        lease = asyncio.create_task(self._hold_lease(), name="broadcast_lease")
+        try:
+            while True:
+                cursor, keys = await redis_client.scan(cursor, match="*" + LANGUAGE_KEY_SUFFIX, count=self.scan_count)
+                counts = await self._send_page(bot, message_key, keys, await redis_client.mget(keys) if keys else [])
+                self.pages += 1
+                if self._lease_lost:
+                    # The new owner resumes from the last checkpoint, which must not move under it
+                    logger.warning({"category": "broadcast", "label": "lease_lost", "value": self.broadcast_id})
+                    return
+                status = await self._checkpoint(cursor, counts)
+                if status != "running":
+                    logger.info({"category": "broadcast", "label": f"broadcast_{status}", "value": self.broadcast_id})
+                    return
+        finally:
+            lease.cancel()
+            await asyncio.gather(lease, return_exceptions=True)
+
+    async def _send_page(self, bot: Bot, message_key: str, keys: List[bytes],
+                         languages: List[Optional[bytes]]) -> Dict[str, int]:
+        counts = dict.fromkeys(COUNTERS, 0)
+        tasks: Set[asyncio.Task] = set()
+        try:
+            for key, language in zip(keys, languages):
+                chat_id = key.decode('utf-8')[:-len(LANGUAGE_KEY_SUFFIX)]
+                if not chat_id.lstrip("-").isdigit():
+                    continue
+                text = get_message(language=language.decode('utf-8') if language else default_lang, key=message_key)
+                await self._pace()
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._send(bot, int(chat_id), text, counts))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            # Only left on shutdown; the page is sent again by whoever resumes the broadcast
+            for task in tasks:
+                task.cancel()
+        return counts
+
+    async def _pace(self) -> None:
+        """Waits for the next send slot, after the process' own load dropped below the soft watermark."""
+        while admission.enabled and admission.load >= admission.soft_watermark:
+            self.yielded += 1
+            await asyncio.sleep(1)
+        delay = self._bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, counts: Dict[str, int]) -> None:
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown", rate_limit_args=Priority.BULK)
+            counts["sent"] += 1
+        except Forbidden:
+            # The user blocked the bot or deleted their account
+            counts["blocked"] += 1
+        except TelegramError as e:
+            counts["failed"] += 1
+            logger.warning({"id": chat_id, "category": "broadcast", "label": "send_failed", "value": str(e)})
+        finally:
+            self._semaphore.release()
+
+    async def _checkpoint(self, cursor: int, counts: Dict[str, int]) -> str:
+        """Records a finished page and returns the broadcast's status, "cancelled" if it was cancelled meanwhile."""
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + counts[name])
+        status = (await redis_client.hget(settings.BROADCAST_KEY, "status") or b"").decode('utf-8')
+        if status == "running" and cursor == 0:
+            status = "done"
+        async with redis_client.pipeline(transaction=True) as pipe:
+            for name in COUNTERS:
+                pipe.hincrby(settings.BROADCAST_KEY, name, counts[name])
+            pipe.hset(settings.BROADCAST_KEY, mapping={"cursor": cursor, "status": status, "updated_at": time.time()})
+            await pipe.execute()
+        return status
+
+    def stats(self) -> dict:
+        return {"broadcast": self.broadcast_id, "sent": self.sent, "blocked": self.blocked, "failed": self.failed,
+                "pages": self.pages, "yielded": self.yielded}
+
+
+broadcaster = Broadcaster()
+
+
+def start_broadcaster(bot: Bot) -> Optional[asyncio.Task]:
+    if not settings.BROADCAST_ENABLED:
+        return None
+    return asyncio.create_task(broadcaster.run(bot), name="broadcaster")
+
+
+async def start_broadcast(message_key: str) -> str:
+    """Records a new broadcast of `message_key` for the bot processes to send, returning its id."""
+    language_init()
+    if get_message(language=default_lang, key=message_key) is None:
+        raise ValueError(f"Message key {message_key!r} is missing from the language files")
+    if (await get_broadcast()).get("status") == "running":
+        raise ValueError("A broadcast is already running, cancel it first")
+    broadcast_id = uuid.uuid4().hex
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(settings.BROADCAST_KEY)
+        pipe.hset(settings.BROADCAST_KEY, mapping={
+            "id": broadcast_id, "message_key": message_key, "status": "running", "cursor": 0,
+            **dict.fromkeys(COUNTERS, 0), "started_at": time.time(), "updated_at": time.time(),
+        })
+        await pipe.execute()
+    return broadcast_id
+
+
+async def cancel_broadcast() -> bool:
+    """Stops the running broadcast after the page being sent, returning whether one was running."""
+    if (await get_broadcast()).get("status") != "running":
+        return False
+    await redis_client.hset(settings.BROADCAST_KEY, "status", "cancelled")
+    return True
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Broadcast an announcement to every user of the bot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="start broadcasting a message of the language files")
+    start.add_argument("message_key", help="key of the message in src/languages/*.json")
+    commands.add_parser("status", help="show the progress of the current or last broadcast")
+    commands.add_parser("cancel", help="stop the running broadcast")
+    args = parser.parse_args()
+    try:
+        if args.command == "start":
+            try:
+                print(f"Broadcast {await start_broadcast(args.message_key)} started")
+            except ValueError as e:
+                parser.exit(1, f"{e}\n")
+        elif args.command == "cancel":
+            print("Broadcast cancelled" if await cancel_broadcast() else "No broadcast is running")
+        else:
+            state = await get_broadcast()
+            print("\n".join(f"{key}: {value}" for key, value in state.items()) or "No broadcast yet")
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from core.config import settings
+
+# Cheap updates that must keep working while queries are shed, e.g. language selection and feedback
+PRIORITY_UPDATE_TYPES = ("callback_query",)
+
+
+class AdmissionController:
+    """
+    Bounds the work a bot process takes on during a surge.
+
+    The load is the number of updates not fully handled yet: from the moment
+    they are handed to the application until every task they started, such as
+    a non-blocking handler waiting for its turn, finished. PTB moves queued
+    updates into tasks right away, so the size of its update queue says next
+    to nothing. Above `soft_watermark` new queries
+    are answered with a short localised "busy" message instead of calling the
+    agent. Above `hard_watermark` the webhook refuses new updates so Telegram
+    retries them later; priority updates such as callback queries are only
+    refused above `priority_watermark`.
+    """
+
+    def __init__(
+            self,
+            enabled: bool = settings.ADMISSION_CONTROL_ENABLED,
+            soft_watermark: int = settings.ADMISSION_SOFT_WATERMARK,
+            hard_watermark: int = settings.ADMISSION_HARD_WATERMARK,
+            priority_watermark: int = settings.ADMISSION_PRIORITY_WATERMARK,
+    ) -> None:
+        self.enabled = enabled
+        self.soft_watermark = soft_watermark
+        self.hard_watermark = hard_watermark
+        self.priority_watermark = priority_watermark
+        # Update id -> holds on it: its arrival, its processing and each task it started
+        self._outstanding: Dict[int, int] = {}
+        self.in_flight = 0
+        self.peak_load = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+
+    def hold(self, update_id: int) -> None:
+        """Counts the update towards the load until every `hold` on it is released."""
+        self._outstanding[update_id] = self._outstanding.get(update_id, 0) + 1
+
+    def release(self, update_id: int) -> None:
+        holds = self._outstanding.get(update_id, 0) - 1
+        if holds > 0:
+            self._outstanding[update_id] = holds
+        else:
+            self._outstanding.pop(update_id, None)
+
+    def is_outstanding(self, update_id: int) -> bool:
+        return update_id in self._outstanding
+
+    @property
+    def load(self) -> int:
+        return len(self._outstanding)
+
+    def admit(self, update_type: Optional[str]) -> bool:
+        """Returns whether the webhook should accept an update of the given type."""
+        if not self.enabled:
+            return True
+        load = self.load
+        self.peak_load = max(self.peak_load, load)
+        limit = self.priority_watermark if update_type in PRIORITY_UPDATE_TYPES else self.hard_watermark
+        if load >= limit:
+            self.rejected += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def should_shed(self) -> bool:
+        """Returns whether a new agent query should get the "busy" reply instead of an answer."""
+        if self.enabled and self.load >= self.soft_watermark:
+            self.shed += 1
+            return True
+        return False
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Counts an agent query as in flight for the duration of the block."""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "load": self.load,
+            "peak_load": self.peak_load,
+            "in_flight": self.in_flight,
+            "soft_watermark": self.soft_watermark,
+            "hard_watermark": self.hard_watermark,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "shed": self.shed,
+        }
+
+
+admission = AdmissionController()
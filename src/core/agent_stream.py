@@ -0,0 +1,45 @@
+import json
+from typing import Any, AsyncIterator, Dict
+
+from core.http_client import get_agent_client
+
+SSE_DONE = "[DONE]"
+
+
+class AgentStreamError(Exception):
+    """Raised when the agent reports an error in the middle of a streamed answer."""
+
+
+async def iter_agent_events(url: str, content: Dict[str, Any]) -> AsyncIterator[dict]:
+    """
+    Posts a query to the streaming agent endpoint and yields its server-sent events.
+
+    `content` holds the httpx arguments carrying the request body, as built by
+    `utils.voice_util.agent_request_content`.
+
+    Every `data:` line is one event. JSON payloads are yielded as they are
+    (`{"text": <delta>}`, `{"audio": <url>}` or `{"error": ...}`), any other
+    payload is treated as a text delta. The stream ends with `data: [DONE]` or
+    when the agent closes the connection.
+    """
+    headers = {**content.get("headers", {}), "Accept": "text/event-stream"}
+    async with get_agent_client().stream("POST", url, **{**content, "headers": headers}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):]
+            # Only the single space after the colon belongs to the framing, deltas keep theirs
+            if payload.startswith(" "):
+                payload = payload[1:]
+            if payload.strip() == SSE_DONE:
+                return
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                event = {"text": payload}
+            if not isinstance(event, dict):
+                event = {"text": str(event)}
+            if event.get("error"):
+                raise AgentStreamError(str(event["error"]))
+            yield event
@@ -17,29 +17,202 @@ class Settings(BaseSettings):
     )
 
     LOG_LEVEL: str = Field(default="INFO")
+    # "text" keeps the classic line format, "json" writes one JSON object per record
+    LOG_FORMAT: str = Field(default="text")
+    # Records are written by a background thread; when its queue is full new records are dropped
+    LOG_QUEUE_ENABLED: bool = Field(default=True)
+    LOG_QUEUE_SIZE: int = Field(default=10000)
+    # Fraction of INFO/DEBUG records to keep per log `label` or `category`, e.g. {"question": 0.01}
+    LOG_SAMPLE_RATES: Dict[str, float] = Field(default={})
     KB_AGENT_BASE_URL: str
+
+    # KB Agent HTTP client Configurations
+    AGENT_CONNECT_TIMEOUT: float = Field(default=10)
+    AGENT_READ_TIMEOUT: float = Field(default=120)
+    AGENT_WRITE_TIMEOUT: float = Field(default=10)
+    AGENT_POOL_TIMEOUT: float = Field(default=30)
+    AGENT_MAX_CONNECTIONS: int = Field(default=256)
+    AGENT_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=64)
+    AGENT_KEEPALIVE_EXPIRY: float = Field(default=60)
+
+    # KB Agent circuit breaker and adaptive concurrency limit Configurations
+    AGENT_BREAKER_FAILURE_THRESHOLD: int = Field(default=5)
+    AGENT_BREAKER_RESET_TIMEOUT: float = Field(default=30)
+    AGENT_BREAKER_HALF_OPEN_CALLS: int = Field(default=1)
+    AGENT_LIMIT_INITIAL: int = Field(default=32)
+    AGENT_LIMIT_MIN: int = Field(default=4)
+    AGENT_LIMIT_MAX: int = Field(default=256)
+    AGENT_LIMIT_TARGET_LATENCY: float = Field(default=30)
+    AGENT_LIMIT_BACKOFF: float = Field(default=0.7)
+    AGENT_LIMIT_QUEUE_TIMEOUT: float = Field(default=10)
+
+    # Agent streaming Configurations
+    # When enabled answers are read from the SSE endpoint and shown while they are generated
+    AGENT_STREAMING_ENABLED: bool = Field(default=False)
+    KB_AGENT_STREAM_PATH: str = Field(default="/chat/stream")
+    STREAM_EDIT_INTERVAL: float = Field(default=1.5)
+    STREAM_EDIT_MIN_CHARS: int = Field(default=20)
+    TYPING_REFRESH_INTERVAL: float = Field(default=4)
+
+    # Agent audio Configurations
+    AUDIO_MAX_BYTES: int = Field(default=20 * 1024 * 1024)
+    AUDIO_DOWNLOAD_TIMEOUT: float = Field(default=30)
+    AUDIO_FILE_ID_TTL: int = Field(default=30 * 24 * 3600)
+
+    # Voice question Configurations
+    # Resolved download URLs of voice messages; Telegram keeps them valid for at least an hour
+    VOICE_FILE_CACHE_SIZE: int = Field(default=10000)
+    VOICE_FILE_CACHE_TTL: int = Field(default=3000)
+    # Streams the recording to the agent as multipart/form-data instead of sending its Telegram URL,
+    # for agents that accept uploads
+    AGENT_AUDIO_UPLOAD: bool = Field(default=False)
     
+    # Feedback sink Configurations
+    # "redis" appends 👍/👎 events to a Redis Stream, "file" to a JSON lines file, "none" drops them
+    FEEDBACK_SINK: str = Field(default="redis")
+    FEEDBACK_STREAM_KEY: str = Field(default="telegram_bot:feedback")
+    FEEDBACK_STREAM_MAXLEN: int = Field(default=1000000)
+    FEEDBACK_FILE_PATH: str = Field(default="feedback.jsonl")
+    # Events held in memory until written; once full the oldest are dropped
+    FEEDBACK_BUFFER_SIZE: int = Field(default=10000)
+    FEEDBACK_BATCH_SIZE: int = Field(default=100)
+    FEEDBACK_FLUSH_INTERVAL: float = Field(default=5)
+
+    # Broadcast Configurations
+    # Bot processes check for a broadcast started with `src/broadcast.py` every BROADCAST_POLL_INTERVAL
+    # seconds; one of them sends it, holding a lease that expires BROADCAST_LEASE_TTL seconds after it stopped
+    BROADCAST_ENABLED: bool = Field(default=True)
+    BROADCAST_KEY: str = Field(default="telegram_bot:broadcast")
+    # Announcements per second, below RATE_LIMIT_GLOBAL_PER_SECOND so answers keep some of it
+    # even when they have to wait for a send in flight
+    BROADCAST_RATE_PER_SECOND: float = Field(default=25)
+    BROADCAST_CONCURRENCY: int = Field(default=16)
+    # Users per SCAN page, progress is checkpointed after every page
+    BROADCAST_SCAN_COUNT: int = Field(default=100)
+    BROADCAST_LEASE_TTL: int = Field(default=60)
+    BROADCAST_POLL_INTERVAL: float = Field(default=10)
+
     # Redis Configurations
     REDIS_HOST: str = Field(default="localhost")
     REDIS_PORT: int = Field(default=6379)
     REDIS_INDEX: int = Field(default=1)
+    REDIS_MAX_CONNECTIONS: int = Field(default=64)
+    REDIS_INVALIDATION_CHANNEL: str = Field(default="telegram_bot:language_invalidation")
+
+    # Answer Cache Configurations
+    # Questions whose normalised text matches one of the patterns are personal and never cached
+    ANSWER_CACHE_ENABLED: bool = Field(default=False)
+    ANSWER_CACHE_SIZE: int = Field(default=10000)
+    ANSWER_CACHE_TTL: int = Field(default=3600)
+    ANSWER_CACHE_REDIS_TTL: int = Field(default=24 * 3600)
+    ANSWER_CACHE_REDIS_PREFIX: str = Field(default="telegram_bot:answer:")
+    ANSWER_CACHE_BYPASS_PATTERNS: List[str] = Field(default=[
+        r"\bhow many\b", r"\bhave i\b", r"\bdo i\b", r"\bam i\b", r"\bmy (progress|enrol\w*|courses?)\b",
+        r"\bnot completed\b", "कितने", "कितनी", "मैंने", "मेरे कोर्स",
+    ])
+
+    # Session Cache Configurations
+    # Most chats whose state is kept in memory, and seconds before it is reloaded from Redis
+    LANGUAGE_CACHE_SIZE: int = Field(default=100000)
+    LANGUAGE_CACHE_TTL: int = Field(default=3600)
+    # Memory cap of the resident user states, and seconds of inactivity after which a chat's is dropped
+    USER_STATE_MAX_BYTES: int = Field(default=32 * 1024 * 1024)
+    USER_STATE_IDLE_TTL: int = Field(default=1800)
 
     # Telegram Configurations
-    TELEGRAM_BASE_URL: str
+    # Public URL of the webhook server, not used with SERVING_MODE=polling
+    TELEGRAM_BASE_URL: str = Field(default="")
     TELEGRAM_BOT_TOKEN: str
     TELEGRAM_BOT_NAME: str
+    # Bot API endpoints, pointed at `benchmarks/fake_telegram.py` for load tests
+    TELEGRAM_API_BASE_URL: str = Field(default="https://api.telegram.org/bot")
+    TELEGRAM_API_BASE_FILE_URL: str = Field(default="https://api.telegram.org/file/bot")
     CONCURRENT_UPDATES: int = Field(default=256)
     POOL_TIMEOUT: int = Field(default=30)
     CONNECTION_POOL_SIZE: int = Field(default=1024)
     CONNECT_TIMEOUT: int = Field(default=300)
     READ_TIMEOUT: int = Field(default=15)
     WRITE_TIMEOUT: int = Field(default=10)
+    # "single" serves and handles updates in one process, "multiprocess" starts
+    # UVICORN_WORKERS handler processes behind a supervisor that shards updates by chat,
+    # "polling" fetches updates with getUpdates instead of receiving them on a webhook
+    SERVING_MODE: str = Field(default="single")
     UVICORN_WORKERS: int = Field(default=4)
+    WORKER_HEARTBEAT_INTERVAL: float = Field(default=1)
+    WORKER_HEARTBEAT_TIMEOUT: float = Field(default=10)
+    WORKER_SHUTDOWN_TIMEOUT: float = Field(default=30)
+    # Updates waiting for a worker, beyond which the webhook answers 503 so Telegram redelivers later
+    WORKER_QUEUE_SIZE: int = Field(default=1000)
+
+    # Long polling Configurations
+    # Updates per getUpdates call (at most 100); they are handled from the update stream,
+    # CONCURRENT_UPDATES at a time
+    POLLING_LIMIT: int = Field(default=100)
+    # Seconds Telegram holds a getUpdates call open while there are no updates
+    POLLING_TIMEOUT: int = Field(default=30)
+    # Seconds between checks for a free handling slot while polling is paused because all are taken
+    POLLING_BUSY_INTERVAL: float = Field(default=0.2)
+
+    # Webhook ingestion Configurations
+    # "direct" hands updates to the in-process application, "stream" appends them to a
+    # Redis Stream that is consumed by `worker.py` processes
+    WEBHOOK_INGESTION_MODE: str = Field(default="direct")
+    # Registered with the webhook and checked on every request, so only Telegram can post updates;
+    # 1-256 characters of A-Z, a-z, 0-9, _ and -. Empty disables the check
+    WEBHOOK_SECRET_TOKEN: str = Field(default="")
+    # Digest of the last webhook registration, so a restart only calls setWebhook when it changed
+    WEBHOOK_FINGERPRINT_KEY: str = Field(default="telegram_bot:webhook")
+    UPDATE_STREAM_KEY: str = Field(default="telegram_bot:updates")
+    UPDATE_STREAM_GROUP: str = Field(default="telegram_bot_workers")
+    UPDATE_STREAM_MAXLEN: int = Field(default=100000)
+    UPDATE_STREAM_BATCH_SIZE: int = Field(default=64)
+    UPDATE_STREAM_BLOCK_MS: int = Field(default=5000)
+    UPDATE_STREAM_CLAIM_IDLE_MS: int = Field(default=300000)
+    UPDATE_STREAM_CLAIM_INTERVAL: float = Field(default=30)
+    # Port on which every `worker.py` process serves its Prometheus metrics, 0 disables it
+    STREAM_WORKER_METRICS_PORT: int = Field(default=8001)
+
+    # Webhook retry deduplication Configurations
+    DEDUP_WINDOW_SIZE: int = Field(default=10000)
+    DEDUP_REDIS_ENABLED: bool = Field(default=False)
+    DEDUP_REDIS_TTL: int = Field(default=3600)
+    DEDUP_REDIS_PREFIX: str = Field(default="telegram_bot:update:")
+
+    # Per-chat coordination Configurations
+    # Messages of a chat arriving within this many seconds of each other are answered by one
+    # agent query. Every answer waits this long, so it is off by default; a message sent while the
+    # previous one still waits for the agent is asked together with it anyway (CHAT_CANCEL_SUPERSEDED)
+    CHAT_COALESCE_WINDOW: float = Field(default=0)
+    # A newer message cancels the chat's previous query while it is still waiting for the agent
+    CHAT_CANCEL_SUPERSEDED: bool = Field(default=True)
+
+    # Webhook admission control Configurations
+    # Load is the updates received but not fully handled yet. Above the soft watermark new
+    # queries get a "busy" reply, above the hard watermark the webhook answers 503
+    ADMISSION_CONTROL_ENABLED: bool = Field(default=True)
+    ADMISSION_SOFT_WATERMARK: int = Field(default=200)
+    ADMISSION_HARD_WATERMARK: int = Field(default=500)
+    ADMISSION_PRIORITY_WATERMARK: int = Field(default=2000)
+    ADMISSION_RETRY_AFTER: int = Field(default=5)
+
+    # Outbound rate limit Configurations
+    RATE_LIMIT_GLOBAL_PER_SECOND: float = Field(default=30)
+    RATE_LIMIT_CHAT_PER_SECOND: float = Field(default=1)
+    RATE_LIMIT_CHAT_BURST: float = Field(default=3)
+    RATE_LIMIT_GROUP_PER_MINUTE: float = Field(default=20)
+    RATE_LIMIT_MAX_RETRIES: int = Field(default=3)
+    # Global tokens bulk sends such as broadcasts leave to every other request
+    RATE_LIMIT_BULK_RESERVE: float = Field(default=5)
    
 
+    # "inline" attaches the 👍/👎 keyboard to the answer, "separate" sends it as its own message
+    FEEDBACK_DELIVERY_MODE: str = Field(default="inline")
+
     WELCOME_MSG: str = "Namaste 🙏\nWelcome to *KB Support Assistant*\n_(Powered by Bhashini)_"
     DEFAULT_LANGUAGE: str = Field(default="en")
     SUPPORTED_LANGUAGES: str = Field(default="en,bn,gu,hi,kn,ml,mr,or,pa,ta,te")
+    # Seconds between checks of the language files for changed copy, 0 disables reloading
+    LANGUAGE_RELOAD_INTERVAL: float = Field(default=30)
     LANGUAGES: List[Dict] = [
         {"text": "English", "code": "en", "index": 1},
         {"text": "বাংলা", "code": "bn", "index": 2},
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from core.config import settings
+from core.logger import logger
+
+
+class _Turn:
+    """One agent query of a chat: the messages it answers and the task answering them."""
+
+    def __init__(self, batch: List[Any], previous: Optional["_Turn"]):
+        self.batch = batch
+        # The chat's turn before this one, which has to finish before this one is answered
+        self.previous = previous
+        self.task: Optional[asyncio.Task] = None
+        # Cleared once the reply starts going out, a half-sent reply is never cancelled
+        self.cancellable = True
+
+
+class _ChatState:
+    def __init__(self):
+        self.pending: List[Any] = []
+        self.version = 0
+        self.active: Optional[_Turn] = None
+
+
+class ChatCoordinator:
+    """
+    Turns the messages of a chat into as few agent queries as possible, answered in order.
+
+    Messages that arrive within `window` seconds of each other are answered by
+    one query. When a new query is ready while the chat's previous one is still
+    waiting for the agent, the previous one is cancelled and its messages are
+    asked again together with the new ones; a previous query that is already
+    replying is waited for instead, so replies of a chat never overtake each
+    other.
+    """
+
+    def __init__(self, window: float = settings.CHAT_COALESCE_WINDOW,
+                 cancel_superseded: bool = settings.CHAT_CANCEL_SUPERSEDED):
+        self.window = window
+        self.cancel_superseded = cancel_superseded
+        self._chats: Dict[Hashable, _ChatState] = {}
+        self.queries = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def handle(self, chat_id: Hashable, item: Any, answer: Callable[[List[Any]], Awaitable[None]]) -> None:
+        """
+        Adds a message of a chat and, unless a later message takes it along,
+        calls `answer` with every message of the chat not answered yet.
+        """
+        chat = self._chats.setdefault(chat_id, _ChatState())
+        chat.pending.append(item)
+        chat.version += 1
+        version = chat.version
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        if chat.version != version:
+            # A later message of this chat arrived within the window and answers this one too
+            self.coalesced += 1
+            return
+
+        batch, chat.pending = chat.pending, []
+        previous = chat.active
+        while (previous is not None and self.cancel_superseded and previous.cancellable
+               and not previous.task.done()):
+            previous.task.cancel()
+            self.cancelled += 1
+            batch = previous.batch + batch
+            logger.info({"id": chat_id, "category": "coordinator", "label": "query_superseded",
+                         "value": len(batch)})
+            previous = previous.previous
+
+        # Registered before the previous turn is waited for, so later messages of the chat queue behind this one
+        turn = _Turn(batch, previous)
+        chat.active = turn
+        turn.task = asyncio.create_task(self._answer(turn, answer))
+        turn.task.add_done_callback(lambda _: self._finish(chat_id, chat, turn))
+        self.queries += 1
+        try:
+            await asyncio.wait({turn.task})
+        except asyncio.CancelledError:
+            turn.task.cancel()
+            raise
+        if not turn.task.cancelled() and turn.task.exception() is not None:
+            raise turn.task.exception()
+
+    @staticmethod
+    async def _answer(turn: _Turn, answer: Callable[[List[Any]], Awaitable[None]]) -> None:
+        if turn.previous is not None:
+            await asyncio.wait({turn.previous.task})
+            turn.previous = None
+        await answer(turn.batch)
+
+    def _finish(self, chat_id: Hashable, chat: _ChatState, turn: _Turn) -> None:
+        if chat.active is not turn:
+            # A later turn of the chat took over and cleans up after itself
+            return
+        previous = turn.previous
+        chat.active = previous if previous is not None and not previous.task.done() else None
+        if chat.active is None and not chat.pending and self._chats.get(chat_id) is chat:
+            self._chats.pop(chat_id)
+
+    def replying(self, chat_id: Hashable) -> None:
+        """Marks the chat's current query as replying, after which a newer message won't cancel it."""
+        chat = self._chats.get(chat_id)
+        turn = chat.active if chat is not None else None
+        while turn is not None and turn.task is not asyncio.current_task():
+            turn = turn.previous
+        if turn is not None:
+            turn.cancellable = False
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "queries": self.queries, "coalesced": self.coalesced,
+                "cancelled": self.cancelled}
+
+
+chat_coordinator = ChatCoordinator()
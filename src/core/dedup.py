@@ -0,0 +1,83 @@
+from array import array
+from typing import Optional
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import DUPLICATE_UPDATES
+from memory.redis import redis_client
+
+
+class UpdateDeduplicator:
+    """
+    Drops Telegram webhook retries of updates that were already accepted.
+
+    The last `window` update ids are kept in a ring buffer with a set for
+    lookups, so memory stays fixed. When `redis_ttl` is set, ids are also
+    claimed with `SET NX` in Redis so that several bot processes share one
+    window; if Redis is unreachable the update is let through.
+    """
+
+    def __init__(self, window: int = settings.DEDUP_WINDOW_SIZE, redis_ttl: Optional[int] = None):
+        self.window = max(window, 1)
+        self.redis_ttl = redis_ttl
+        self._ring = array('q', [-1] * self.window)
+        self._position = 0
+        self._seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def _remember(self, update_id: int) -> None:
+        evicted = self._ring[self._position]
+        if evicted != -1:
+            self._seen.discard(evicted)
+        self._ring[self._position] = update_id
+        self._seen.add(update_id)
+        self._position = (self._position + 1) % self.window
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Returns True if the update was seen before, otherwise records it."""
+        if update_id in self._seen:
+            self.hits += 1
+            DUPLICATE_UPDATES.labels(source="local").inc()
+            return True
+        self._remember(update_id)
+        if self.redis_ttl:
+            try:
+                claimed = await redis_client.set(settings.DEDUP_REDIS_PREFIX + str(update_id), 1,
+                                                 nx=True, ex=self.redis_ttl)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning({"category": "dedup", "label": "redis_failed", "value": str(e)})
+                claimed = True
+            if not claimed:
+                self.hits += 1
+                self.redis_hits += 1
+                DUPLICATE_UPDATES.labels(source="redis").inc()
+                return True
+        self.misses += 1
+        return False
+
+    async def forget(self, update_id: int) -> None:
+        """Lets Telegram's retry of an update through again, after accepting it failed."""
+        if update_id in self._seen:
+            self._seen.discard(update_id)
+            self._ring[self._ring.index(update_id)] = -1
+        if self.redis_ttl:
+            try:
+                await redis_client.delete(settings.DEDUP_REDIS_PREFIX + str(update_id))
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning({"category": "dedup", "label": "redis_failed", "value": str(e)})
+
+    def stats(self) -> dict:
+        return {"window": self.window, "hits": self.hits, "misses": self.misses,
+                "redis_hits": self.redis_hits, "redis_errors": self.redis_errors}
+
+
+def create_deduplicator() -> UpdateDeduplicator:
+    return UpdateDeduplicator(
+        window=settings.DEDUP_WINDOW_SIZE,
+        redis_ttl=settings.DEDUP_REDIS_TTL if settings.DEDUP_REDIS_ENABLED else None,
+    )
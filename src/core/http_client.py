@@ -0,0 +1,69 @@
+import ssl
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+
+from core.config import settings
+from core.logger import logger
+
+# Shared async client for calls to the KB agent. It holds a keep-alive
+# connection pool so that concurrent handlers don't block the event loop and
+# don't pay a new TCP/TLS handshake on every request.
+_agent_client: Optional[httpx.AsyncClient] = None
+
+
+@lru_cache
+def tls_context() -> ssl.SSLContext:
+    """
+    The TLS context shared by every HTTP client of the process.
+
+    Each client otherwise builds its own and loads the CA bundle again, which
+    takes tens of milliseconds per client at startup.
+    """
+    return httpx.create_ssl_context()
+
+
+def create_agent_client() -> httpx.AsyncClient:
+    """Builds an async client with the pool limits and timeouts from settings."""
+    return httpx.AsyncClient(
+        base_url=settings.KB_AGENT_BASE_URL,
+        verify=tls_context(),
+        timeout=httpx.Timeout(
+            connect=settings.AGENT_CONNECT_TIMEOUT,
+            read=settings.AGENT_READ_TIMEOUT,
+            write=settings.AGENT_WRITE_TIMEOUT,
+            pool=settings.AGENT_POOL_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.AGENT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AGENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.AGENT_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def init_agent_client() -> httpx.AsyncClient:
+    """Creates the shared agent client. Call once on application startup."""
+    global _agent_client
+    if _agent_client is None:
+        _agent_client = create_agent_client()
+        logger.info({"category": "http_client", "label": "agent_client_started",
+                     "value": settings.KB_AGENT_BASE_URL})
+    return _agent_client
+
+
+async def close_agent_client() -> None:
+    """Closes the shared agent client and its pooled connections."""
+    global _agent_client
+    if _agent_client is not None:
+        await _agent_client.aclose()
+        _agent_client = None
+        logger.info({"category": "http_client", "label": "agent_client_closed"})
+
+
+def get_agent_client() -> httpx.AsyncClient:
+    """Returns the shared agent client, raising if it has not been started."""
+    if _agent_client is None:
+        raise RuntimeError("Agent HTTP client is not initialised, call init_agent_client() first")
+    return _agent_client
@@ -1,16 +1,131 @@
+import atexit
+import json
 import logging
-import os
+import logging.handlers
+import queue
+import random
+import time
+from typing import Dict, Optional
 from .config import settings
 
 logger_name = settings.TELEGRAM_BOT_NAME
 log_level = settings.LOG_LEVEL
 
 log_format = '%(asctime)s - %(thread)d - %(threadName)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(
-    level=log_level,
-    format=log_format,
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
+date_format = '%Y-%m-%d %H:%M:%S'
+
+
+def _resolve_lazy(message: dict) -> dict:
+    """Calls the callable values of a log dict, so costly fields are only built for records that are written."""
+    return {key: value() if callable(value) else value for key, value in message.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    """Writes one JSON object per record, with the fields of dict messages at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime(date_format, time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(_resolve_lazy(record.msg))
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The plain text format, resolving lazy fields of dict messages."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if isinstance(record.msg, dict):
+            record.msg = _resolve_lazy(record.msg)
+        return super().format(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records of some events.
+
+    `rates` maps a `label` or `category` of dict messages to the fraction of
+    records to keep, e.g. `{"question": 0.01}`. Warnings and errors are
+    always kept.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rates or record.levelno >= logging.WARNING or not isinstance(record.msg, dict):
+            return True
+        rate = self.rates.get(record.msg.get("label"), self.rates.get(record.msg.get("category")))
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them on the caller's thread.
+
+    Dict messages are copied so that later changes by the caller don't leak
+    into the record. When the queue is full the record is dropped and counted
+    rather than blocking the event loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        elif record.args:
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            # Tracebacks hold frames of the caller, they are rendered while those are still valid
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_formatter() -> logging.Formatter:
+    if settings.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return TextFormatter(fmt=log_format, datefmt=date_format)
+
+
+def _configure_logging() -> Optional[logging.handlers.QueueListener]:
+    """Routes every log record through one stream handler, written by a background thread unless disabled."""
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(_build_formatter())
+    if not settings.LOG_QUEUE_ENABLED:
+        stream_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+        logging.basicConfig(level=log_level, handlers=[stream_handler])
+        return None
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    # Sampled out records never reach the queue
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+    logging.basicConfig(level=log_level, handlers=[queue_handler])
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Flushes the records still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = _configure_logging()
 
 # Configure the logger
 logger = logging.getLogger(logger_name)
@@ -21,4 +136,5 @@ logger = logging.getLogger(logger_name)
 # logger.info("This is an info message.")
 # logger.warning("This is a warning message.")
 # logger.error("This is an error message.")
-# logger.critical("This is a critical message.")
\ No newline at end of file
+# logger.critical("This is a critical message.")
+# logger.debug({"category": "agent", "label": "request_body", "value": lambda: json.dumps(body)})  # built only if written
@@ -0,0 +1,148 @@
+"""
+Prometheus metrics of the bot, served on `/metrics`.
+
+Latencies are histograms per pipeline stage: webhook to handler, Redis
+commands, KB agent calls, Telegram Bot API calls and agent audio downloads.
+Outstanding updates, queue depths and in-flight work are gauges read when
+the endpoint is scraped.
+
+With `SERVING_MODE=multiprocess` the metrics are recorded in the worker
+processes, so they are kept in `PROMETHEUS_MULTIPROC_DIR` (a fresh temporary
+directory unless it is set) and the supervisor's `/metrics` adds up those of
+every process. The gauges are then refreshed by each worker's heartbeat.
+"""
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+from core.config import settings
+
+# Set before prometheus_client is imported, which picks where values are kept then; workers inherit it
+_created_multiprocess_dir: Optional[str] = None
+if settings.SERVING_MODE == "multiprocess" and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    _created_multiprocess_dir = tempfile.mkdtemp(prefix="telegram_bot_metrics_")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _created_multiprocess_dir
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess, start_http_server)
+
+from core.admission import admission
+from core.resilience import CircuitState, agent_guard
+from memory.cache import TTLCache
+
+# Agent answers take seconds to minutes, the default buckets stop at 10s
+AGENT_LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+UPDATES = Counter("telegram_bot_updates_total", "Updates received on the webhook", ["type"])
+UPDATE_QUEUE_WAIT = Histogram("telegram_bot_update_queue_wait_seconds",
+                              "Time from webhook receipt until the handlers pick the update up")
+REDIS_COMMAND_LATENCY = Histogram("telegram_bot_redis_command_seconds", "Redis command latency", ["command"])
+AGENT_LATENCY = Histogram("telegram_bot_kb_agent_request_seconds", "KB agent answer latency",
+                          ["kind", "language", "mode"], buckets=AGENT_LATENCY_BUCKETS)
+TELEGRAM_API_LATENCY = Histogram("telegram_bot_telegram_api_request_seconds", "Telegram Bot API request latency",
+                                 ["method"])
+AUDIO_DOWNLOAD_LATENCY = Histogram("telegram_bot_audio_download_seconds", "Agent audio download time")
+ERRORS = Counter("telegram_bot_errors_total", "Errors by component", ["component"])
+RETRY_AFTER = Counter("telegram_bot_telegram_retry_after_total", "RetryAfter responses from Telegram", ["method"])
+ANSWER_CACHE_LOOKUPS = Counter("telegram_bot_answer_cache_lookups_total", "Answer cache lookups by result",
+                               ["result"])
+DUPLICATE_UPDATES = Counter("telegram_bot_duplicate_updates_total",
+                            "Redelivered updates dropped as duplicates, by where they were recognised", ["source"])
+# Summed over the live processes in multiprocess mode
+OUTSTANDING_UPDATES = Gauge("telegram_bot_outstanding_updates", "Updates received but not fully handled yet",
+                            multiprocess_mode="livesum")
+IN_FLIGHT_QUERIES = Gauge("telegram_bot_in_flight_queries", "Questions currently being answered",
+                          multiprocess_mode="livesum")
+OUTBOUND_QUEUE_DEPTH = Gauge("telegram_bot_outbound_queue_depth", "Bot API requests waiting for the rate limiter",
+                             multiprocess_mode="livesum")
+# The worst breaker and the summed limits of the live processes in multiprocess mode
+AGENT_BREAKER_STATE = Gauge("telegram_bot_kb_agent_breaker_state",
+                            "KB agent circuit breaker state: 0 closed, 1 half open, 2 open",
+                            multiprocess_mode="livemax")
+AGENT_CONCURRENCY_LIMIT = Gauge("telegram_bot_kb_agent_concurrency_limit",
+                                "Adaptive limit of concurrent KB agent calls", multiprocess_mode="livesum")
+
+# Gauges set by `refresh_gauges`, a function gauge is only read by the process serving `/metrics`
+_gauge_sources: Dict[Gauge, Callable[[], float]] = {}
+
+
+def _bind_gauge(gauge: Gauge, source: Callable[[], float]) -> None:
+    if MULTIPROCESS:
+        _gauge_sources[gauge] = source
+    else:
+        gauge.set_function(source)
+
+
+def refresh_gauges() -> None:
+    """Writes the current gauge values, which only multiprocess mode needs."""
+    for gauge, source in _gauge_sources.items():
+        gauge.set(source())
+
+
+_BREAKER_STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+_bind_gauge(OUTSTANDING_UPDATES, lambda: admission.load)
+_bind_gauge(IN_FLIGHT_QUERIES, lambda: admission.in_flight)
+_bind_gauge(AGENT_BREAKER_STATE, lambda: _BREAKER_STATE_VALUES[agent_guard.breaker.state])
+_bind_gauge(AGENT_CONCURRENCY_LIMIT, lambda: agent_guard.limiter.limit)
+
+# Receipt time of updates the handlers have not picked up yet; entries of dropped updates expire
+_received_at = TTLCache(maxsize=100000, ttl=600)
+
+
+def bind_queue_gauges(outbound_queue_size: Callable[[], int]) -> None:
+    """Reads the queue gauges from the running application."""
+    _bind_gauge(OUTBOUND_QUEUE_DEPTH, outbound_queue_size)
+
+
+def count_update(update_type: Optional[str]) -> None:
+    UPDATES.labels(type=update_type or "unknown").inc()
+
+
+def mark_received(update_id: int, update_type: Optional[str]) -> None:
+    """Counts an update handed to the in-process application and starts its queue wait clock."""
+    count_update(update_type)
+    _received_at.set(update_id, time.monotonic())
+
+
+def mark_picked_up(update_id: int) -> None:
+    received_at = _received_at.pop(update_id)
+    if received_at is not None:
+        UPDATE_QUEUE_WAIT.observe(time.monotonic() - received_at)
+
+
+def _registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+# Taken from here by the servers, importing prometheus_client before this module would keep values in-process
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render_metrics() -> bytes:
+    return generate_latest(_registry())
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves the metrics on their own port from a background thread, for processes without a web server."""
+    start_http_server(port, registry=_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops the live gauges of a worker process that exited."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def remove_multiprocess_dir() -> None:
+    """Removes the metrics directory on shutdown, if this process created it."""
+    if _created_multiprocess_dir is not None:
+        shutil.rmtree(_created_multiprocess_dir, ignore_errors=True)
+
@@ -0,0 +1,264 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import RETRY_AFTER, TELEGRAM_API_LATENCY
+
+
+class Priority(IntEnum):
+    """Outbound request classes, lower values are sent first."""
+    ANSWER = 0
+    FEEDBACK = 1
+    TYPING = 2
+    BULK = 3
+
+
+# Endpoints that are not a direct answer to the user get a lower default priority
+ENDPOINT_PRIORITIES: Dict[str, Priority] = {
+    "sendChatAction": Priority.TYPING,
+    "editMessageReplyMarkup": Priority.FEEDBACK,
+}
+
+# Endpoints that don't count towards the per-chat message limit
+CHAT_UNLIMITED_ENDPOINTS = {"sendChatAction", "answerCallbackQuery"}
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations, so callers can sleep until their turn."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Takes a token and returns how long to wait before it may be used."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_acquire(self, reserve: float = 0.0) -> float:
+        """Takes a token if one is available beyond `reserve`, otherwise returns the time until one is."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0.0
+        return (1 + reserve - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+def _seconds(retry_after: Union[int, float, datetime.timedelta]) -> float:
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Throttles every request the bot sends to the Telegram Bot API.
+
+    Requests for a chat first wait on that chat's token bucket (private chats
+    and groups have different limits), then queue for the global bucket, which
+    is handed out in `Priority` order. `BULK` requests only get a global token
+    while `bulk_reserve` more are left, so a burst of answers never waits for
+    tokens taken by a broadcast. A `RetryAfter` from Telegram pauses all
+    sending for the requested time before the request is retried.
+
+    The priority of a request can be set with `rate_limit_args=Priority.<...>`
+    on any bot method; otherwise it is derived from the endpoint.
+    """
+
+    def __init__(
+            self,
+            global_rate: float = settings.RATE_LIMIT_GLOBAL_PER_SECOND,
+            chat_rate: float = settings.RATE_LIMIT_CHAT_PER_SECOND,
+            chat_burst: float = settings.RATE_LIMIT_CHAT_BURST,
+            group_rate_per_minute: float = settings.RATE_LIMIT_GROUP_PER_MINUTE,
+            max_retries: int = settings.RATE_LIMIT_MAX_RETRIES,
+            bulk_reserve: float = settings.RATE_LIMIT_BULK_RESERVE,
+            max_chat_buckets: int = 4096,
+    ) -> None:
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._bulk_reserve = bulk_reserve
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate_per_minute / 60
+        self._max_retries = max_retries
+        self._max_chat_buckets = max_chat_buckets
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._queued = {priority: 0 for priority in Priority}
+        self._sent = {priority: 0 for priority in Priority}
+        self._wait_total = {priority: 0.0 for priority in Priority}
+        self._wait_max = {priority: 0.0 for priority in Priority}
+        # Requests without a chat (getMe, getFile, setWebhook, ...), which are never throttled
+        self.unthrottled = 0
+        self.retry_after_count = 0
+
+    async def initialize(self) -> None:
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="rate_limiter_dispatcher")
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, future in self._queue:
+            if not future.done():
+                future.cancel()
+        self._queue.clear()
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._max_chat_buckets:
+                # Buckets that refilled completely hold no state worth keeping
+                for key in [key for key, value in self._chat_buckets.items() if value.is_full()]:
+                    del self._chat_buckets[key]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self._group_rate, 1) if is_group else TokenBucket(self._chat_rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self) -> None:
+        """Hands out global tokens to queued requests, highest priority first."""
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            reserve = self._bulk_reserve if self._queue[0][0] >= Priority.BULK else 0.0
+            delay = self._global_bucket.try_acquire(reserve)
+            if delay > 0:
+                if reserve:
+                    # A request of higher priority queued meanwhile may use the reserve right away
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(delay)
+                continue
+            while self._queue:
+                priority, _, future = heapq.heappop(self._queue)
+                self._queued[priority] -= 1
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                # Every waiter was cancelled, give the token back
+                self._global_bucket.tokens += 1
+
+    async def _acquire_global(self, priority: Priority) -> None:
+        if self._dispatcher is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        self._queued[priority] += 1
+        self._wakeup.set()
+        await future
+
+    def _priority(self, endpoint: str, rate_limit_args: Optional[int]) -> Priority:
+        if rate_limit_args is not None:
+            return Priority(rate_limit_args)
+        return ENDPOINT_PRIORITIES.get(endpoint, Priority.ANSWER)
+
+    def _record_wait(self, priority: Priority, waited: float) -> None:
+        self._sent[priority] += 1
+        self._wait_total[priority] += waited
+        self._wait_max[priority] = max(self._wait_max[priority], waited)
+
+    async def process_request(
+            self,
+            callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+            args: Any,
+            kwargs: Dict[str, Any],
+            endpoint: str,
+            data: Dict[str, Any],
+            rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        priority = self._priority(endpoint, rate_limit_args)
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+
+        for attempt in range(self._max_retries + 1):
+            started_at = time.monotonic()
+            if chat_id is not None:
+                if endpoint not in CHAT_UNLIMITED_ENDPOINTS:
+                    delay = self._chat_bucket(chat_id).reserve()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self._acquire_global(priority)
+                self._record_wait(priority, time.monotonic() - started_at)
+            else:
+                # Kept out of the per-priority numbers, which are about messages to users
+                self.unthrottled += 1
+            try:
+                with TELEGRAM_API_LATENCY.labels(method=endpoint).time():
+                    return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                self.retry_after_count += 1
+                RETRY_AFTER.labels(method=endpoint).inc()
+                retry_after = _seconds(exc.retry_after)
+                if attempt == self._max_retries:
+                    logger.error({"category": "rate_limiter", "label": "retry_after_exhausted",
+                                  "value": endpoint, "retry_after": retry_after})
+                    raise
+                logger.warning({"category": "rate_limiter", "label": "retry_after",
+                                "value": endpoint, "retry_after": retry_after})
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                await asyncio.sleep(retry_after)
+        return None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued.values())
+
+    def stats(self) -> dict:
+        """Queue depth and wait time per priority class."""
+        return {
+            "queue_depth": self.queue_depth,
+            "retry_after": self.retry_after_count,
+            "chat_buckets": len(self._chat_buckets),
+            "unthrottled": self.unthrottled,
+            "priorities": {
+                priority.name.lower(): {
+                    "queued": self._queued[priority],
+                    "sent": self._sent[priority],
+                    "wait_avg": self._wait_total[priority] / self._sent[priority] if self._sent[priority] else 0.0,
+                    "wait_max": self._wait_max[priority],
+                }
+                for priority in Priority
+            },
+        }
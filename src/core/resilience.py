@@ -0,0 +1,235 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import AsyncIterator, Deque, Optional
+
+import httpx
+
+from core.config import settings
+from core.logger import logger
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+
+
+class ConcurrencyLimitError(Exception):
+    """Raised when no call slot became free within the queue timeout."""
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a backend after `failure_threshold` consecutive failures.
+
+    While open every call is rejected at once. After `reset_timeout` seconds the
+    breaker lets `half_open_calls` probe calls through: a success closes it
+    again, a failure opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, half_open_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state != self.state:
+            logger.warning({"category": "circuit_breaker", "label": self.name, "value": state.value,
+                            "previous": self.state.value})
+            self.state = state
+
+    def allow(self) -> bool:
+        """Returns whether a call may go ahead; every allowed call must be followed by `record`."""
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self._set_state(CircuitState.HALF_OPEN)
+            self.probes_in_flight = 0
+        if self.state == CircuitState.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def record(self, success: Optional[bool]) -> None:
+        """Records the outcome of an allowed call, `None` for calls that ended without telling anything."""
+        if self.state == CircuitState.HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+        if success is None:
+            return
+        if success:
+            self.consecutive_failures = 0
+            self._set_state(CircuitState.CLOSED)
+            return
+        self.consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._set_state(CircuitState.OPEN)
+
+    def stats(self) -> dict:
+        return {"state": self.state.value, "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected, "times_opened": self.times_opened}
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps in-flight calls with a limit that adapts to the backend (AIMD with slow start).
+
+    While the limit is in use, every call that succeeds within `target_latency`
+    raises it: by one until the first failure, so it doubles per round of
+    calls and catches up with a surge within a few agent latencies, and by
+    1/limit, about one per round, once it is back at the limit the last failure
+    backed off to. A failed or slow call multiplies it by `backoff`. Callers
+    over the limit queue for at most `queue_timeout` seconds before they are
+    rejected.
+    """
+
+    def __init__(self, initial_limit: float, min_limit: float, max_limit: float, target_latency: float,
+                 backoff: float, queue_timeout: float):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        # Below it the limit grows by one per success, above it by 1/limit
+        self.slow_start_threshold = self.max_limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                # The slot was handed over just as the caller was cancelled, pass it on
+                self.release(0, None)
+            else:
+                self._remove_waiter(waiter)
+            raise
+        if not waiter.done():
+            self._remove_waiter(waiter)
+            self.rejected += 1
+            raise ConcurrencyLimitError(f"No call slot free within {self.queue_timeout}s "
+                                        f"(limit {int(self.limit)})")
+
+    def _remove_waiter(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, latency: float, success: Optional[bool]) -> None:
+        """Frees a call slot and adapts the limit, unless `success` is None."""
+        # Only a limit that was reached says anything about whether it is too low
+        saturated = bool(self._waiters) or self.in_flight * 2 >= self.limit
+        self.in_flight -= 1
+        if success is None:
+            pass
+        elif success and latency <= self.target_latency:
+            if saturated:
+                step = 1 if self.limit < self.slow_start_threshold else 1 / self.limit
+                self.limit = min(self.max_limit, self.limit + step)
+        else:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self.slow_start_threshold = self.limit
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {"limit": round(self.limit, 2), "slow_start_threshold": round(self.slow_start_threshold, 2),
+                "in_flight": self.in_flight, "queued": len(self._waiters), "rejected": self.rejected}
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Whether an exception says something about the backend's health, client errors (4xx) don't."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, Exception)
+
+
+class BackendGuard:
+    """Circuit breaker and adaptive concurrency limit in front of one backend."""
+
+    def __init__(self, breaker: CircuitBreaker, limiter: AdaptiveConcurrencyLimiter):
+        self.breaker = breaker
+        self.limiter = limiter
+
+    @asynccontextmanager
+    async def call(self) -> AsyncIterator[None]:
+        """
+        Wraps one backend call, failing fast with `CircuitOpenError` or
+        `ConcurrencyLimitError` when the backend can't take it.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker '{self.breaker.name}' is open")
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            # Rejected or cancelled while queued, either way a half-open probe must be given back
+            self.breaker.record(None)
+            raise
+        started_at = time.monotonic()
+        success: Optional[bool] = True
+        try:
+            yield
+        except asyncio.CancelledError:
+            success = None
+            raise
+        except BaseException as e:
+            success = not is_backend_failure(e)
+            raise
+        finally:
+            self.limiter.release(time.monotonic() - started_at, success)
+            self.breaker.record(success)
+
+    def stats(self) -> dict:
+        return {"breaker": self.breaker.stats(), "limiter": self.limiter.stats()}
+
+
+agent_guard = BackendGuard(
+    CircuitBreaker(
+        "kb_agent",
+        failure_threshold=settings.AGENT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.AGENT_BREAKER_RESET_TIMEOUT,
+        half_open_calls=settings.AGENT_BREAKER_HALF_OPEN_CALLS,
+    ),
+    AdaptiveConcurrencyLimiter(
+        initial_limit=settings.AGENT_LIMIT_INITIAL,
+        min_limit=settings.AGENT_LIMIT_MIN,
+        max_limit=settings.AGENT_LIMIT_MAX,
+        target_latency=settings.AGENT_LIMIT_TARGET_LATENCY,
+        backoff=settings.AGENT_LIMIT_BACKOFF,
+        queue_timeout=settings.AGENT_LIMIT_QUEUE_TIMEOUT,
+    ),
+)
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from core.config import settings
+from core.logger import logger
+from memory.redis import redis_client
+from utils.update_util import HANDLED_UPDATE_TYPES
+
+
+def webhook_url() -> str:
+    return f"{settings.TELEGRAM_BASE_URL}/telegram"
+
+
+def _fingerprint_key() -> str:
+    # The bot id is the part of the token before the colon, several bots may share a Redis
+    return f"{settings.WEBHOOK_FINGERPRINT_KEY}:{settings.TELEGRAM_BOT_TOKEN.partition(':')[0]}"
+
+
+def _fingerprint(url: str) -> str:
+    """Digest of the registration, including the secret token that `getWebhookInfo` doesn't report."""
+    registration = [url, sorted(HANDLED_UPDATE_TYPES), settings.WEBHOOK_SECRET_TOKEN]
+    return hashlib.sha256(json.dumps(registration).encode('utf-8')).hexdigest()
+
+
+async def _stored_fingerprint() -> Optional[str]:
+    try:
+        value = await redis_client.get(_fingerprint_key())
+    except Exception as e:
+        # Registering again is always safe, only slower
+        logger.warning({"category": "webhook", "label": "fingerprint_read_failed", "value": str(e)})
+        return None
+    return value.decode('utf-8') if value is not None else None
+
+
+async def ensure_webhook(bot: Bot) -> bool:
+    """
+    Registers the webhook unless Telegram already has this exact registration.
+
+    `getWebhookInfo` reports the URL and update types, and the fingerprint
+    stored in Redis by the last registration covers the secret token, so a
+    rolling restart skips `setWebhook` while a changed URL, update types or
+    secret registers again. Returns whether `setWebhook` was called.
+    """
+    url = webhook_url()
+    fingerprint = _fingerprint(url)
+    info, stored = await asyncio.gather(bot.get_webhook_info(), _stored_fingerprint())
+    if (info.url == url and set(info.allowed_updates or ()) == set(HANDLED_UPDATE_TYPES)
+            and stored == fingerprint):
+        logger.info({"category": "webhook", "label": "webhook_unchanged", "value": url})
+        return False
+    await bot.set_webhook(url=url, allowed_updates=HANDLED_UPDATE_TYPES,
+                          secret_token=settings.WEBHOOK_SECRET_TOKEN or None)
+    logger.info({"category": "webhook", "label": "webhook_registered", "value": url})
+    try:
+        await redis_client.set(_fingerprint_key(), fingerprint)
+    except Exception as e:
+        logger.warning({"category": "webhook", "label": "fingerprint_write_failed", "value": str(e)})
+    return True
+
+
+async def register_webhook(bot: Bot, retry_delay: float = 5.0) -> None:
+    """Runs `ensure_webhook` until it succeeds; the process reports ready once this returns."""
+    while True:
+        try:
+            # A no-op for the application's bot, which is initialized already
+            await bot.initialize()
+            await ensure_webhook(bot)
+            return
+        except TelegramError as e:
+            logger.error({"category": "webhook", "label": "webhook_registration_failed", "value": str(e)})
+            await asyncio.sleep(retry_delay)
@@ -1,11 +1,12 @@
-import requests
+import httpx
 from dataclasses import dataclass
-from typing import TypedDict, Union
+from typing import Optional, TypedDict, Union
 from telegram.ext import (
     Application,
     CallbackContext,
     ExtBot
 )
+from memory.user_state import UserState, UserStateStore, user_states
 
 @dataclass
 class WebhookUpdate:
@@ -14,12 +15,24 @@ class WebhookUpdate:
     payload: str
 
 
-class CustomContext(CallbackContext[ExtBot, dict, dict, dict]):
+class CustomContext(CallbackContext[ExtBot, UserState, dict, dict]):
     """
     Custom CallbackContext class that makes `user_data` available for updates of type
     `WebhookUpdate`.
+
+    `user_data` is the chat's record in `user_store` rather than an entry of
+    PTB's never evicted per-user dicts, so memory stays bounded however many
+    users the bot has. The state lives per chat, like the Redis session; in the
+    private chats the bot serves the chat id is the user id.
     """
 
+    user_store: UserStateStore = user_states
+
+    @property
+    def user_data(self) -> Optional[UserState]:
+        key = self._chat_id if self._chat_id is not None else self._user_id
+        return self.user_store.get_or_create(key) if key is not None else None
+
     @classmethod
     def from_update(
             cls,
@@ -36,5 +49,5 @@ class ApiResponse(TypedDict):
 
 
 class ApiError(TypedDict):
-    error: Union[str, requests.exceptions.RequestException]
+    error: Union[str, httpx.HTTPError]
 
@@ -0,0 +1,498 @@
+"""
+Telegram handlers shared by every ingress mode of the bot.
+
+The webhook server (`server.py`) and the stream worker (`worker.py`) both build
+their PTB `Application` through `build_application`, so an update is handled
+the same way no matter how it reached the bot.
+"""
+import asyncio
+import time
+import httpx
+from typing import List, Optional, Tuple, Union
+
+from telegram import Bot, Message, Update
+from telegram import __version__ as TG_VER
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import (Application, CommandHandler, ContextTypes,
+                          CallbackQueryHandler, MessageHandler, TypeHandler,)
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+from telegram.ext import filters
+
+from utils.language_util import language_init, get_languages, get_message, start_language_reloader
+from utils.audio_util import send_agent_audio, AudioTooLargeError
+from utils.message_util import split_message
+from utils.markup_util import markups
+from utils.voice_util import agent_request_content, resolve_voice_url
+from broadcast import start_broadcaster
+from core.config import settings
+from core.logger import logger
+from core.admission import admission
+from core.coordinator import chat_coordinator
+from core.metrics import AGENT_LATENCY, ERRORS, mark_picked_up
+from core.rate_limiter import PriorityRateLimiter, Priority
+from core.http_client import init_agent_client, close_agent_client, get_agent_client, tls_context
+from core.agent_stream import iter_agent_events, AgentStreamError
+from core.resilience import agent_guard, CircuitOpenError, ConcurrencyLimitError
+from memory.redis import close_redis
+from memory.answer_cache import answer_cache
+from memory.feedback_sink import feedback_sink, start_feedback_flusher
+from memory.session import get_user_language, set_user_language, start_language_invalidation_listener
+from memory.user_state import UserState
+from data_models import ApiError, ApiResponse, CustomContext
+
+try:
+    from telegram import __version_info__
+except ImportError:
+    __version_info__ = (0, 0, 0, 0, 0)  # type: ignore[assignment]
+
+if __version_info__ < (20, 0, 0, "alpha", 1):
+    raise RuntimeError(
+        f"This example is not compatible with your current PTB version {TG_VER}. To view the "
+        f"{TG_VER} version of this example, "
+        f"visit https://docs.python-telegram-bot.org/en/v{TG_VER}/examples.html"
+    )
+
+
+async def get_user_langauge(update: Update, default_lang=settings.DEFAULT_LANGUAGE) -> str:
+    return await get_user_language(update.effective_chat.id, default_lang)
+
+async def send_message_to_bot(chat_id, text, context: CustomContext, parse_mode="Markdown") -> None:
+    """Send a message  to bot"""
+    await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+
+async def start(update: Update, context: CustomContext) -> None:
+    """Send a message when the command /start is issued."""
+    user_name = update.message.chat.first_name
+    logger.info({"id": update.effective_chat.id, "username": user_name, "category": "logged_in", "label": "logged_in"})
+    await send_message_to_bot(update.effective_chat.id, settings.WELCOME_MSG, context)
+    await language_handler(update, context)
+
+async def language_handler(update: Update, context: CustomContext):
+    if get_languages():
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="\nPlease select a language to proceed",
+                                       reply_markup=markups.get("language"))
+    else:
+        return query_handler
+
+async def preferred_language_callback(update: Update, context: CustomContext):
+    callback_query = update.callback_query
+    preferred_language = callback_query.data[len("lang_"):]
+    await set_user_language(update.effective_chat.id, preferred_language)
+    logger.info(
+        {"id": update.effective_chat.id, "username": update.effective_chat.first_name, "category": "language_selection",
+         "label": "engine_selection", "value": preferred_language})
+    await callback_query.answer()
+    await context_handler(update, context)
+    # return query_handler
+
+async def context_handler(update: Update, context: CustomContext):
+    selected_language = await get_user_langauge(update)
+    text_message = get_message(language=selected_language, key="language_selection")
+    reply_markup = None    
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text_message, reply_markup=reply_markup, parse_mode="Markdown") 
+
+async def help_command(update: Update, context: CustomContext) -> None:
+    """Send a message when the command /help is issued."""
+    await update.message.reply_text("Help!")
+
+def get_bot_endpoint():
+    return settings.KB_AGENT_BASE_URL + '/chat/send'
+
+def get_bot_stream_endpoint():
+    return settings.KB_AGENT_BASE_URL + settings.KB_AGENT_STREAM_PATH
+
+def get_agent_request_body(query: str, voice_message_url: str, voice_message_language: str, update: Update) -> dict:
+    reqBody: dict = {
+            "session_id": str(update.message.from_user.id),
+            "channel_id": "telegram",
+            "text": query,
+            "language": voice_message_language,
+            "audio": ''
+        }
+    if voice_message_url is not None:
+        reqBody["audio"] = voice_message_url
+    return reqBody
+
+def get_query_kind(voice_message_url: Optional[str]) -> str:
+    return "text" if voice_message_url is None else "voice"
+
+async def get_cached_answer(query: str, voice_message_url: str, voice_message_language: str,
+                            update: Update) -> Tuple[Optional[str], Optional[ApiResponse]]:
+    """Returns the answer cache key of a question and the cached answer, if there is one."""
+    cache_key = answer_cache.cache_key(query, voice_message_language) if voice_message_url is None else None
+    cached_answer = await answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info({"id": update.effective_chat.id, "category": "get_query_response", "label": "answer_cache_hit",
+                     "value": query})
+    return cache_key, cached_answer
+        
+async def get_query_response(query: str, voice_message_url: str, voice_message_language: str, update: Update,
+                             context: CustomContext) -> Union[ApiResponse, ApiError]:
+    logger.info({"id": update.effective_chat.id, "username": update.effective_chat.first_name, "language_selected": voice_message_language})
+    url = get_bot_endpoint()
+    try:
+        reqBody = get_agent_request_body(query, voice_message_url, voice_message_language, update)
+        cache_key, cached_answer = await get_cached_answer(query, voice_message_url, voice_message_language, update)
+        if cached_answer is not None:
+            return cached_answer
+
+        logger.debug({"id": update.effective_chat.id, "category": "get_query_response", "label": "request_body",
+                      "value": reqBody})
+        headers = {
+            # "x-source": "telegram",
+            # "x-request-id": str(message_id),
+            # "x-device-id": f"d{user_id}",
+            # "x-consumer-id": str(user_id)
+        }
+        with AGENT_LATENCY.labels(kind=get_query_kind(voice_message_url), language=voice_message_language,
+                                  mode="send").time():
+            async with agent_guard.call():
+                response = await get_agent_client().post(url, **agent_request_content(reqBody, voice_message_url))
+                response.raise_for_status()
+                data = response.json()
+        if not (data.get("text") or "").strip():
+            return {'error': 'Empty answer received from API'}
+        await answer_cache.set(cache_key, data)
+        return data
+    except (httpx.HTTPError, CircuitOpenError, ConcurrencyLimitError) as e:
+        return {'error': e}
+    except (KeyError, ValueError):
+        return {'error': 'Invalid response received from API'}
+
+async def keep_typing(chat_id: int, context: CustomContext) -> None:
+    """Refreshes the typing indicator, which Telegram clears after about 5 seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(settings.TYPING_REFRESH_INTERVAL)
+        try:
+            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+        except TelegramError as e:
+            logger.warning({"id": chat_id, "category": "keep_typing", "label": "typing_failed", "value": str(e)})
+
+async def read_agent_stream(content: dict, kind: str, language: str, events: asyncio.Queue) -> None:
+    """Puts the events of the agent's answer stream into `events`, followed by None once it ends."""
+    try:
+        with AGENT_LATENCY.labels(kind=kind, language=language, mode="stream").time():
+            async with agent_guard.call():
+                async for event in iter_agent_events(get_bot_stream_endpoint(), content):
+                    events.put_nowait(event)
+    finally:
+        events.put_nowait(None)
+
+async def stream_query_response(query: str, voice_message_url: str, voice_message_language: str, update: Update,
+                                context: CustomContext) -> Tuple[Union[ApiResponse, ApiError], Optional[Message]]:
+    """
+    Streams the answer from the agent into a message that is edited as tokens arrive.
+
+    The first tokens are sent as soon as they arrive, later ones are coalesced into
+    at most one edit per `STREAM_EDIT_INTERVAL`. The stream is read by a task of its
+    own, so Telegram errors and waits don't count towards the agent's health.
+    Returns the complete response and the progress message, which the caller
+    finalises with the Markdown-escaped answer.
+    """
+    logger.info({"id": update.effective_chat.id, "username": update.effective_chat.first_name, "language_selected": voice_message_language})
+    chat_id = update.effective_chat.id
+    cache_key, cached_answer = await get_cached_answer(query, voice_message_url, voice_message_language, update)
+    if cached_answer is not None:
+        return cached_answer, None
+
+    reqBody = get_agent_request_body(query, voice_message_url, voice_message_language, update)
+    typing = asyncio.create_task(keep_typing(chat_id, context))
+    # Only reading the stream counts towards the agent's health, the edits below wait on Telegram
+    events: asyncio.Queue = asyncio.Queue()
+    reader = asyncio.create_task(read_agent_stream(agent_request_content(reqBody, voice_message_url),
+                                                   get_query_kind(voice_message_url), voice_message_language,
+                                                   events))
+    message: Optional[Message] = None
+    answer, audio, shown = "", "", ""
+    last_edit_at = 0.0
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            answer += event.get("text") or ""
+            audio = event.get("audio") or audio
+            preview = answer[:MessageLimit.MAX_TEXT_LENGTH]
+            if not preview.strip():
+                continue
+            now = time.monotonic()
+            if message is None:
+                chat_coordinator.replying(chat_id)
+                message = await context.bot.send_message(chat_id=chat_id, text=preview)
+            elif (now - last_edit_at >= settings.STREAM_EDIT_INTERVAL
+                  and len(preview) - len(shown) >= settings.STREAM_EDIT_MIN_CHARS):
+                await context.bot.edit_message_text(preview, chat_id=chat_id, message_id=message.message_id)
+            else:
+                continue
+            shown, last_edit_at = preview, now
+        # Raises what ended the stream, if it did not end normally
+        await reader
+    except (httpx.HTTPError, CircuitOpenError, ConcurrencyLimitError) as e:
+        return {'error': e}, message
+    except AgentStreamError as e:
+        return {'error': str(e)}, message
+    finally:
+        typing.cancel()
+        reader.cancel()
+
+    if not answer.strip():
+        return {'error': 'Empty answer received from API'}, message
+    response = {"text": answer, "audio": audio}
+    await answer_cache.set(cache_key, response)
+    return response, message
+
+async def send_answer(update: Update, context: CustomContext, response: ApiResponse,
+                      progress_message: Optional[Message] = None) -> None:
+    """Sends the escaped answer, its feedback keyboard and audio, finalising a streamed progress message."""
+    chat_id = update.effective_chat.id
+    feedback_sink.record_answer(chat_id, update.message.id, time.time() - update.message.date.timestamp())
+    reply_markup = markups.render("feedback", update.message.id)
+    # In "inline" mode the feedback keyboard rides on the last answer message instead of a message of its own
+    inline_feedback = settings.FEEDBACK_DELIVERY_MODE == "inline"
+    chunks = split_message(response['text'])
+    for index, chunk in enumerate(chunks):
+        is_last = index == len(chunks) - 1
+        chunk_markup = reply_markup if inline_feedback and is_last else None
+        if index == 0 and progress_message is not None:
+            try:
+                await context.bot.edit_message_text(escape_markdown(chunk), chat_id=chat_id,
+                                                    message_id=progress_message.message_id, parse_mode="Markdown",
+                                                    reply_markup=chunk_markup)
+            except BadRequest as e:
+                # The last progress edit may already show exactly this text
+                if "not modified" not in str(e):
+                    raise
+        else:
+            await context.bot.send_message(chat_id=chat_id, text=escape_markdown(chunk), parse_mode="Markdown",
+                                           reply_markup=chunk_markup)
+    if not inline_feedback:
+        await context.bot.send_message(chat_id=chat_id, text="Please provide your feedback", parse_mode="Markdown",
+                                       reply_markup=reply_markup, rate_limit_args=Priority.FEEDBACK)
+    if response.get("audio"):
+        try:
+            await send_agent_audio(context.bot, chat_id, response["audio"])
+        except (httpx.HTTPError, AudioTooLargeError) as e:
+            ERRORS.labels(component="audio").inc()
+            logger.error({"id": chat_id, "category": "handle_query_response",
+                          "label": "audio_failed", "value": str(e)})
+
+async def response_handler(update: Update, context: CustomContext) -> None:
+    await query_handler(update, context)
+
+
+async def query_handler(update: Update, context: CustomContext):
+    if update.message.text:
+        logger.info({"id": update.effective_chat.id, "username": update.effective_chat.first_name, "category": "query_handler", "label": "question", "value": update.message.text})
+    # Messages sent in quick succession are answered together, by the handler of the last one
+    await chat_coordinator.handle(update.effective_chat.id, update,
+                                  lambda updates: answer_updates(updates, context))
+    return query_handler
+
+async def answer_updates(updates: List[Update], context: CustomContext) -> None:
+    """Answers one or more consecutive messages of a chat with a single agent query."""
+    update = updates[-1]
+    query = "\n".join(item.message.text for item in updates if item.message.text) or None
+    voice_messages = [item.message.voice for item in updates if item.message.voice]
+    # The agent takes one recording per query, the latest one stands for the others
+    voice_message = voice_messages[-1] if voice_messages else None
+
+    if admission.should_shed():
+        logger.warning({"id": update.effective_chat.id, "category": "query_handler", "label": "query_shed",
+                        "value": admission.load})
+        busy_msg = get_message(language=await get_user_langauge(update), key="busy_msg")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=busy_msg)
+        return
+
+    with admission.track():
+        # loading_msg = get_message(language=selected_language, key="context_loading_msg")
+        # await context.bot.send_message(chat_id=update.effective_chat.id, text=loading_msg)
+        # await context.bot.send_message(chat_id=update.effective_chat.id, text=f'Just a few seconds...')
+        # The typing action has the lowest outbound priority, the query doesn't wait for it to go out
+        typing = context.application.create_task(
+            context.bot.sendChatAction(chat_id=update.effective_chat.id, action="typing"), update=update)
+        # Neither depends on the other, so they cost one round-trip instead of two
+        selected_language, voice_message_url = await asyncio.gather(
+            get_user_langauge(update),
+            resolve_voice_url(voice_message),
+        )
+        if voice_message_url is not None:
+            logger.info({"id": update.effective_chat.id, "username": update.effective_chat.first_name, "category": "query_handler", "label": "voice_question", "value": voice_message_url})
+        await handle_query_response(update, context, query, voice_message_url, selected_language, typing)
+
+async def handle_query_response(update: Update, context: CustomContext, query: str, voice_message_url: str,
+                                selected_language: str, typing: Optional[asyncio.Task] = None):
+    progress_message = None
+    if settings.AGENT_STREAMING_ENABLED:
+        response, progress_message = await stream_query_response(query, voice_message_url, selected_language, update, context)
+    else:
+        response = await get_query_response(query, voice_message_url, selected_language, update, context)
+    if typing is not None:
+        # Still waiting for the rate limiter, it would show the user typing after the answer
+        typing.cancel()
+    chat_coordinator.replying(update.effective_chat.id)
+    if "error" in response:
+        ERRORS.labels(component="kb_agent").inc()
+        error_msg = get_message(language=selected_language, key="context_error_msg")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=error_msg)
+        info_msg = {"id": update.effective_chat.id, "username": update.effective_chat.first_name,
+                    "category": "handle_query_response", "label": "question_sent", "value": query}
+        logger.info(info_msg)
+        merged = dict()
+        merged.update(info_msg)
+        merged.update(response)
+        logger.error(merged)
+    else:
+        logger.info({"id": update.effective_chat.id, "username": update.effective_chat.first_name,
+                     "category": "handle_query_response", "label": "answer_received", "value": query})
+        await send_answer(update, context, response, progress_message)
+
+async def preferred_feedback_callback(update: Update, context: CustomContext) -> None:
+    """Parses the CallbackQuery and updates the message text."""
+    query = update.callback_query
+    queryData = query.data.split("__")
+    user_id = update.callback_query.from_user.id
+    # # CallbackQueries need to be answered, even if no notification to the user is needed
+    # # Some clients may have trouble otherwise. See https://core.telegram.org/bots/api#callbackquery
+    await query.answer("Thanks for your feedback.")
+    await record_feedback(update, queryData[0], queryData[1] if len(queryData) > 1 else None)
+    # await query.delete_message()
+    reply_markup = markups.get("feedback_liked" if queryData[0] == "message-liked" else "feedback_disliked")
+    # Only the markup changes, so this works whether the keyboard sits on the answer or on its own message
+    await context.bot.edit_message_reply_markup(chat_id=query.message.chat_id, message_id=query.message.message_id,
+                                                reply_markup=reply_markup, rate_limit_args=Priority.FEEDBACK)
+
+async def record_feedback(update: Update, feedback: str, message_id: Optional[str]) -> None:
+    """Buffers a 👍/👎 event for the feedback sink, which writes it out in the background."""
+    query = update.callback_query
+    chat_id = update.effective_chat.id
+    question_id = int(message_id) if message_id and message_id.isdigit() else None
+    feedback_sink.add({
+        "feedback": feedback[len("message-"):],
+        "message_id": question_id,
+        "answer_message_id": query.message.message_id if query.message else None,
+        "chat_id": chat_id,
+        "user_id": query.from_user.id,
+        "language": await get_user_langauge(update),
+        "bot": settings.TELEGRAM_BOT_NAME,
+        "answer_latency": feedback_sink.answer_latency(chat_id, question_id),
+        # Seconds between the answer and the click
+        "feedback_delay": round(time.time() - query.message.date.timestamp(), 3) if query.message else None,
+        "timestamp": time.time(),
+    })
+
+async def preferred_feedback_reply_callback(update: Update, context: CustomContext) -> None:
+    """Parses the CallbackQuery and updates the message text."""
+    query = update.callback_query
+    # # CallbackQueries need to be answered, even if no notification to the user is needed
+    # # Some clients may have trouble otherwise. See https://core.telegram.org/bots/api#callbackquery
+    await query.answer()
+
+
+async def record_pickup(update: Update, context: CustomContext) -> None:
+    """Records how long the update waited between the webhook and the handlers."""
+    mark_picked_up(update.update_id)
+
+
+class TrackedApplication(Application):
+    """
+    Counts every update towards the admission load until it is fully handled.
+
+    Ingress that puts updates into the update queue holds them on arrival;
+    updates handed to `process_update` directly are held from there. Tasks
+    started for an update, e.g. its non-blocking handlers, hold it until they
+    finish.
+    """
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            await super().process_update(update)
+            return
+        if not admission.is_outstanding(update.update_id):
+            admission.hold(update.update_id)
+        try:
+            await super().process_update(update)
+        finally:
+            admission.release(update.update_id)
+
+    def create_task(self, coroutine, update: Optional[object] = None, *, name: Optional[str] = None) -> asyncio.Task:
+        task = super().create_task(coroutine, update=update, name=name)
+        if isinstance(update, Update):
+            update_id = update.update_id
+            admission.hold(update_id)
+            task.add_done_callback(lambda _: admission.release(update_id))
+        return task
+
+
+def build_application(block: bool = False, **builder_kwargs) -> Application:
+    """
+    Builds the PTB application with every bot handler registered.
+
+    With `block=False` handlers run as background tasks, which is what the
+    webhook server wants. Callers that need to know when an update has been
+    fully handled, such as the stream worker acking entries, pass `block=True`
+    so that `process_update` only returns once the handler finished.
+    """
+    context_types = ContextTypes(context=CustomContext, user_data=UserState)
+    # Here we set updater to None because we want our custom webhook server to handle the updates.persistence(persistence)
+    # and hence we don't need an Updater instance
+    # Built here rather than by the builder, so that both share the process' TLS context
+    request = HTTPXRequest(connection_pool_size=settings.CONNECTION_POOL_SIZE, pool_timeout=settings.POOL_TIMEOUT,
+                           connect_timeout=settings.CONNECT_TIMEOUT, read_timeout=settings.READ_TIMEOUT,
+                           write_timeout=settings.WRITE_TIMEOUT, httpx_kwargs={"verify": tls_context()})
+    get_updates_request = HTTPXRequest(httpx_kwargs={"verify": tls_context()})
+    application = (
+        Application.builder().application_class(TrackedApplication).token(settings.TELEGRAM_BOT_TOKEN)
+            .updater(None).context_types(context_types)
+            .base_url(settings.TELEGRAM_API_BASE_URL).base_file_url(settings.TELEGRAM_API_BASE_FILE_URL)
+            .request(request).get_updates_request(get_updates_request)
+            .concurrent_updates(settings.CONCURRENT_UPDATES).rate_limiter(PriorityRateLimiter()).build()
+    )
+
+    # register handlers
+    # Runs before the handlers of group 0 and is cheap enough to never run as a task of its own
+    application.add_handler(TypeHandler(Update, record_pickup, block=True), group=-1)
+    application.add_handler(CommandHandler("start", start, block=block))
+    application.add_handler(CommandHandler("help", help_command, block=block))
+    application.add_handler(CommandHandler('select_language', language_handler, block=block))
+    application.add_handler(CallbackQueryHandler(preferred_language_callback, pattern=r'lang_\w*', block=block))
+    application.add_handler(CallbackQueryHandler(preferred_feedback_callback, pattern=r'message-\w*', block=block))
+    application.add_handler(CallbackQueryHandler(preferred_feedback_reply_callback, pattern=r'replymessage_\w*', block=block))
+    application.add_handler(MessageHandler(filters.TEXT | filters.VOICE, response_handler, block=block))
+    return application
+
+
+async def init_resources(bot: Optional[Bot] = None) -> List[asyncio.Task]:
+    """
+    Loads the language files and opens the shared clients used by the handlers.
+
+    Processes that pass their `bot` also take part in sending broadcasts.
+    """
+    language_init()
+    await init_agent_client()
+    background_tasks = []
+    invalidation_listener = start_language_invalidation_listener()
+    if invalidation_listener:
+        background_tasks.append(invalidation_listener)
+    language_reloader = start_language_reloader()
+    if language_reloader:
+        background_tasks.append(language_reloader)
+    feedback_flusher = start_feedback_flusher()
+    if feedback_flusher:
+        background_tasks.append(feedback_flusher)
+    broadcaster = start_broadcaster(bot) if bot is not None else None
+    if broadcaster:
+        background_tasks.append(broadcaster)
+    return background_tasks
+
+
+async def close_resources(background_tasks: Optional[List[asyncio.Task]] = None) -> None:
+    """Stops the background tasks from `init_resources` and closes the shared clients."""
+    for task in background_tasks or []:
+        task.cancel()
+    await asyncio.gather(*(background_tasks or []), return_exceptions=True)
+    # Written before Redis closes, so no click of this process is lost
+    await feedback_sink.flush()
+    await close_agent_client()
+    await close_redis()
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import re
+import unicodedata
+from typing import List, Optional
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import ANSWER_CACHE_LOOKUPS
+from memory.cache import TTLCache
+from memory.redis import redis_client
+
+
+def normalise_query(text: str) -> str:
+    """
+    Normalises a question so that trivially different spellings share a cache entry.
+
+    Applies Unicode NFC (Indic scripts have several encodings of the same
+    syllable), case folding, turns punctuation such as "?" or the danda "।"
+    into spaces and collapses whitespace.
+    """
+    text = unicodedata.normalize("NFC", unicodedata.normalize("NFC", text).casefold())
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    """
+    Two-tier cache of agent answers keyed by normalised question and language.
+
+    Answers are looked up in a bounded in-process TTL/LRU cache first and then
+    in Redis, which is shared by all bot processes. Questions matching one of
+    the bypass patterns are about the user's own data and are never cached.
+    """
+
+    def __init__(
+            self,
+            enabled: bool = settings.ANSWER_CACHE_ENABLED,
+            maxsize: int = settings.ANSWER_CACHE_SIZE,
+            ttl: int = settings.ANSWER_CACHE_TTL,
+            redis_ttl: int = settings.ANSWER_CACHE_REDIS_TTL,
+            bypass_patterns: List[str] = settings.ANSWER_CACHE_BYPASS_PATTERNS,
+    ) -> None:
+        self.enabled = enabled
+        self.redis_ttl = redis_ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.bypass_patterns = [re.compile(pattern) for pattern in bypass_patterns]
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def cache_key(self, query: str, language: str) -> Optional[str]:
+        """Returns the cache key of a question, or None if it must not be cached."""
+        if not self.enabled or not query:
+            return None
+        normalised = normalise_query(query)
+        if not normalised or any(pattern.search(normalised) for pattern in self.bypass_patterns):
+            self.bypassed += 1
+            return None
+        digest = hashlib.sha256(f"{language}\x1f{normalised}".encode('utf-8')).hexdigest()
+        return settings.ANSWER_CACHE_REDIS_PREFIX + digest
+
+    async def get(self, key: Optional[str]) -> Optional[dict]:
+        if key is None:
+            return None
+        answer = self.local.get(key)
+        if answer is not None:
+            self.local_hits += 1
+            ANSWER_CACHE_LOOKUPS.labels(result="local_hit").inc()
+            return answer
+        try:
+            cached = await redis_client.get(key)
+        except Exception as e:
+            logger.warning({"category": "answer_cache", "label": "redis_get_failed", "value": str(e)})
+            cached = None
+        if cached is None:
+            self.misses += 1
+            ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+        answer = json.loads(cached)
+        self.local.set(key, answer)
+        self.redis_hits += 1
+        ANSWER_CACHE_LOOKUPS.labels(result="redis_hit").inc()
+        return answer
+
+    async def set(self, key: Optional[str], answer: dict) -> None:
+        if key is None or not answer.get("text"):
+            return
+        self.local.set(key, answer)
+        try:
+            await redis_client.set(key, json.dumps(answer), ex=self.redis_ttl)
+        except Exception as e:
+            logger.warning({"category": "answer_cache", "label": "redis_set_failed", "value": str(e)})
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.local),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
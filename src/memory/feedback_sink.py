@@ -0,0 +1,124 @@
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from core.config import settings
+from core.logger import logger
+from memory.cache import TTLCache
+from memory.redis import redis_client
+
+EVENT_FIELD = b"event"
+
+
+class FeedbackSink:
+    """
+    Buffers 👍/👎 feedback events in memory and writes them out in batches.
+
+    `add` only appends to a ring buffer of `buffer_size` events, so a click
+    never waits for a write; once full, the oldest events are dropped and
+    counted. The buffer is written when `batch_size` events are waiting, every
+    `flush_interval` seconds and by `flush` on shutdown, to the Redis Stream
+    `FEEDBACK_STREAM_KEY` ("redis") or as JSON lines to `FEEDBACK_FILE_PATH`
+    ("file"). A batch that fails to write goes back into the buffer.
+    """
+
+    def __init__(self, sink: str = settings.FEEDBACK_SINK, buffer_size: int = settings.FEEDBACK_BUFFER_SIZE,
+                 batch_size: int = settings.FEEDBACK_BATCH_SIZE,
+                 flush_interval: float = settings.FEEDBACK_FLUSH_INTERVAL):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # (chat_id, question message id) -> seconds from question to answer, for the recent answers
+        self._answer_latencies = TTLCache(maxsize=buffer_size, ttl=3600)
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink in ("redis", "file")
+
+    def record_answer(self, chat_id: int, message_id: int, latency: float) -> None:
+        if self.enabled:
+            self._answer_latencies.set((chat_id, message_id), round(latency, 3))
+
+    def answer_latency(self, chat_id: int, message_id: int) -> Optional[float]:
+        """Seconds the answer to a question took, if this process answered it recently."""
+        return self._answer_latencies.get((chat_id, message_id))
+
+    def add(self, event: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> None:
+        """Writes out every buffered event, batch by batch."""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    await self._write(batch)
+                except asyncio.CancelledError:
+                    self._restore(batch)
+                    raise
+                except Exception as e:
+                    self.failed_flushes += 1
+                    logger.error({"category": "feedback_sink", "label": "flush_failed", "value": str(e),
+                                  "events": len(batch)})
+                    self._restore(batch)
+                    return
+                self.written += len(batch)
+
+    def _restore(self, batch: List[Dict[str, Any]]) -> None:
+        """Puts an unwritten batch back in front, unless newer events filled the buffer meanwhile."""
+        kept = batch[:self._buffer.maxlen - len(self._buffer)]
+        self.dropped += len(batch) - len(kept)
+        self._buffer.extendleft(reversed(kept))
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if self.sink == "redis":
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for event in batch:
+                    pipe.xadd(settings.FEEDBACK_STREAM_KEY, {EVENT_FIELD: json.dumps(event)},
+                              maxlen=settings.FEEDBACK_STREAM_MAXLEN, approximate=True)
+                await pipe.execute()
+        else:
+            lines = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch)
+            await asyncio.to_thread(self._append, lines)
+
+    @staticmethod
+    def _append(lines: str) -> None:
+        with open(settings.FEEDBACK_FILE_PATH, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def run(self) -> None:
+        """Flushes whenever a batch is full or `flush_interval` passed, until cancelled."""
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            # Shielded so cancelling the flusher on shutdown doesn't interrupt a write, the final `flush` waits for it
+            await asyncio.shield(self.flush())
+
+    def stats(self) -> dict:
+        return {"sink": self.sink, "buffered": len(self._buffer), "written": self.written,
+                "dropped": self.dropped, "failed_flushes": self.failed_flushes}
+
+
+feedback_sink = FeedbackSink()
+
+
+def start_feedback_flusher() -> Optional[asyncio.Task]:
+    if not feedback_sink.enabled:
+        return None
+    return asyncio.create_task(feedback_sink.run(), name="feedback_flusher")
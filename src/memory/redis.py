@@ -1,14 +1,34 @@
-import redis
+import redis.asyncio as redis
 from core.config import settings
+from core.metrics import REDIS_COMMAND_LATENCY
 
-# Connect to Redis
-redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_INDEX)  # Adjust host and port if needed
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that records the latency of every command it executes."""
+
+    async def execute_command(self, *args, **options):
+        command = args[0].decode() if isinstance(args[0], bytes) else str(args[0])
+        with REDIS_COMMAND_LATENCY.labels(command=command.upper()).time():
+            return await super().execute_command(*args, **options)
+
+
+# Shared async connection pool, connections are opened lazily on first use
+redis_pool = redis.ConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_INDEX,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+)
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
 
 # Define a function to store and retrieve data in Redis
-def store_data(key, value):
-    redis_client.set(key, value)
+async def store_data(key, value):
+    await redis_client.set(key, value)
 
-def retrieve_data(key):
-    data_from_redis = redis_client.get(key)
+async def retrieve_data(key):
+    data_from_redis = await redis_client.get(key)
     return data_from_redis.decode('utf-8') if data_from_redis is not None else None
 
+async def close_redis():
+    await redis_client.aclose()
+    await redis_pool.disconnect()
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import socket
+from typing import Optional
+
+from core.config import settings
+from core.logger import logger
+from memory.redis import redis_client
+from memory.user_state import user_states
+
+# Identifies this process on the invalidation channel so it can skip its own messages
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+# Preferred languages are stored as `<chat_id>_language`, which is also how `broadcast` finds every user
+LANGUAGE_KEY_SUFFIX = '_language'
+
+
+def language_key(chat_id) -> str:
+    return str(chat_id) + LANGUAGE_KEY_SUFFIX
+
+
+async def get_user_language(chat_id, default_lang: str = settings.DEFAULT_LANGUAGE) -> str:
+    """Returns the preferred language of a chat, reading Redis only when its state isn't resident."""
+    state = user_states.get(chat_id)
+    if state is None:
+        value = await redis_client.get(language_key(chat_id))
+        state = user_states.hydrate(chat_id, value.decode('utf-8') if value is not None else None)
+    return state.language or default_lang
+
+
+async def set_user_language(chat_id, language: str) -> None:
+    """Writes the preferred language through the user state and tells other processes to drop theirs."""
+    user_states.hydrate(chat_id, language)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(language_key(chat_id), language)
+        pipe.publish(settings.REDIS_INVALIDATION_CHANNEL, f"{INSTANCE_ID}:{chat_id}")
+        await pipe.execute()
+
+
+def _invalidate(message: bytes) -> None:
+    instance_id, _, chat_id = message.decode('utf-8').rpartition(':')
+    if instance_id == INSTANCE_ID:
+        return
+    try:
+        user_states.pop(int(chat_id))
+    except ValueError:
+        user_states.pop(chat_id)
+
+
+async def language_invalidation_listener(retry_delay: float = 1.0) -> None:
+    """
+    Drops user states whose language was changed by another bot process.
+
+    Runs until cancelled. The store is cleared whenever the subscription is
+    (re)established, since invalidations may have been missed while it was down.
+    """
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(settings.REDIS_INVALIDATION_CHANNEL)
+            user_states.clear()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error({"category": "session_store", "label": "invalidation_listener_error", "value": str(e)})
+            await asyncio.sleep(retry_delay)
+        finally:
+            await pubsub.aclose()
+
+
+def start_language_invalidation_listener() -> Optional[asyncio.Task]:
+    if not settings.LANGUAGE_CACHE_SIZE:
+        return None
+    return asyncio.create_task(language_invalidation_listener(), name="language_invalidation_listener")
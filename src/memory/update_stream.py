@@ -0,0 +1,160 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Set
+
+from redis.exceptions import ResponseError
+
+from core.config import settings
+from core.logger import logger
+from memory.redis import redis_client
+from memory.session import INSTANCE_ID
+from utils.update_util import json_loads
+
+UPDATE_FIELD = b"update"
+
+
+async def publish_update(raw_update: bytes) -> bytes:
+    """Appends a raw Telegram update to the update stream and returns its entry id."""
+    return await redis_client.xadd(
+        settings.UPDATE_STREAM_KEY,
+        {UPDATE_FIELD: raw_update},
+        maxlen=settings.UPDATE_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+async def publish_updates(raw_updates: List[bytes]) -> None:
+    """Appends several raw Telegram updates in one round trip, in order."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for raw_update in raw_updates:
+            pipe.xadd(settings.UPDATE_STREAM_KEY, {UPDATE_FIELD: raw_update},
+                      maxlen=settings.UPDATE_STREAM_MAXLEN, approximate=True)
+        await pipe.execute()
+
+
+async def ensure_consumer_group() -> None:
+    """Creates the stream and its consumer group if they don't exist yet."""
+    try:
+        await redis_client.xgroup_create(settings.UPDATE_STREAM_KEY, settings.UPDATE_STREAM_GROUP,
+                                         id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+class UpdateStreamConsumer:
+    """
+    Consumes Telegram updates from the Redis update stream as part of a consumer group.
+
+    Each entry is handed to `handler` in its own task, at most `concurrency` at
+    a time, and acknowledged once the handler returns. Entries left pending by
+    a worker that died are claimed again after `UPDATE_STREAM_CLAIM_IDLE_MS`.
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[dict], Awaitable[None]],
+            consumer_name: str = INSTANCE_ID,
+            concurrency: int = settings.CONCURRENT_UPDATES,
+    ) -> None:
+        self.handler = handler
+        self.consumer_name = consumer_name
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self.handled = 0
+        self.failed = 0
+        self.reclaimed = 0
+
+    @property
+    def saturated(self) -> bool:
+        """Whether every handling slot is taken, so entries read now would have to wait."""
+        return self._semaphore.locked()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Reads and handles entries until `stop` is called, then waits for in-flight ones."""
+        await ensure_consumer_group()
+        reclaimer = asyncio.create_task(self._reclaim_loop(), name="update_stream_reclaimer")
+        logger.info({"category": "update_stream", "label": "consumer_started", "value": self.consumer_name})
+        try:
+            while not self._stopping.is_set():
+                try:
+                    entries = await self._read()
+                    if entries is None:
+                        break
+                except Exception as e:
+                    logger.error({"category": "update_stream", "label": "read_failed", "value": str(e)})
+                    await asyncio.sleep(1)
+                    continue
+                for _, messages in entries or []:
+                    for entry_id, fields in messages:
+                        await self._spawn(entry_id, fields)
+        finally:
+            reclaimer.cancel()
+            await asyncio.gather(reclaimer, return_exceptions=True)
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            logger.info({"category": "update_stream", "label": "consumer_stopped", "value": self.consumer_name})
+
+    async def _read(self) -> Optional[list]:
+        """Reads new entries, or returns None when `stop` is called while the read blocks."""
+        read = asyncio.create_task(redis_client.xreadgroup(
+            settings.UPDATE_STREAM_GROUP, self.consumer_name, {settings.UPDATE_STREAM_KEY: ">"},
+            count=settings.UPDATE_STREAM_BATCH_SIZE, block=settings.UPDATE_STREAM_BLOCK_MS,
+        ))
+        stopping = asyncio.create_task(self._stopping.wait())
+        await asyncio.wait({read, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not read.done():
+            # Entries delivered meanwhile stay pending and are reclaimed by a consumer later
+            read.cancel()
+            await asyncio.gather(read, return_exceptions=True)
+            return None
+        return read.result()
+
+    async def _spawn(self, entry_id: bytes, fields: Optional[dict]) -> None:
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._handle(entry_id, fields))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, entry_id: bytes, fields: Optional[dict]) -> None:
+        try:
+            if fields and UPDATE_FIELD in fields:
+                await self.handler(json_loads(fields[UPDATE_FIELD]))
+                self.handled += 1
+        except Exception as e:
+            # The application already reports handler errors, anything reaching here is
+            # a malformed entry that would fail again on every redelivery
+            self.failed += 1
+            logger.error({"category": "update_stream", "label": "handle_failed",
+                          "value": entry_id.decode('utf-8'), "error": str(e)})
+        finally:
+            self._semaphore.release()
+        await redis_client.xack(settings.UPDATE_STREAM_KEY, settings.UPDATE_STREAM_GROUP, entry_id)
+
+    async def _reclaim_loop(self) -> None:
+        """Takes over entries that another consumer read but never acknowledged."""
+        while True:
+            await asyncio.sleep(settings.UPDATE_STREAM_CLAIM_INTERVAL)
+            try:
+                start_id = "0-0"
+                while True:
+                    result = await redis_client.xautoclaim(
+                        settings.UPDATE_STREAM_KEY, settings.UPDATE_STREAM_GROUP, self.consumer_name,
+                        min_idle_time=settings.UPDATE_STREAM_CLAIM_IDLE_MS, start_id=start_id,
+                        count=settings.UPDATE_STREAM_BATCH_SIZE,
+                    )
+                    start_id, messages = result[0], result[1]
+                    for entry_id, fields in messages:
+                        self.reclaimed += 1
+                        await self._spawn(entry_id, fields)
+                    if start_id in (b"0-0", "0-0"):
+                        break
+            except Exception as e:
+                logger.error({"category": "update_stream", "label": "reclaim_failed", "value": str(e)})
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "handled": self.handled, "failed": self.failed,
+                "reclaimed": self.reclaimed}
@@ -0,0 +1,123 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from core.config import settings
+
+
+class UserState:
+    """
+    What the bot keeps in memory about a chat, a copy of its Redis session.
+
+    Slotted so a resident user costs a fixed few dozen bytes instead of a
+    dict; language codes are interned, so all users share one string per
+    language.
+    """
+
+    __slots__ = ("language", "loaded_at", "last_seen")
+
+    def __init__(self, language: Optional[str] = None, loaded_at: Optional[float] = None, last_seen: float = 0.0):
+        self.language = sys.intern(language) if language else None
+        # None until the state was read from Redis
+        self.loaded_at = loaded_at
+        self.last_seen = last_seen
+
+
+# Estimated cost of an entry besides the record and its key: the OrderedDict slot and link node
+_ENTRY_OVERHEAD = 128
+
+
+def _entry_size(key: Hashable) -> int:
+    return sys.getsizeof(UserState()) + sys.getsizeof(key) + _ENTRY_OVERHEAD
+
+
+class UserStateStore:
+    """
+    Bounded in-process store of per-chat state, hydrated lazily from Redis.
+
+    Holds at most `max_users` records and about `max_bytes` of memory,
+    evicting the least recently seen chat first. Records of chats idle for
+    more than `idle_ttl` seconds are dropped as new chats come in, and a record
+    loaded more than `ttl` seconds ago is reported stale so the caller reloads
+    it from Redis. Not thread-safe; meant to be used from the event loop only.
+    """
+
+    def __init__(self, max_users: int = settings.LANGUAGE_CACHE_SIZE,
+                 max_bytes: int = settings.USER_STATE_MAX_BYTES,
+                 idle_ttl: float = settings.USER_STATE_IDLE_TTL,
+                 ttl: float = settings.LANGUAGE_CACHE_TTL):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._records: "OrderedDict[Hashable, UserState]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[UserState]:
+        """Returns the chat's record if it is resident and loaded recently enough, marking the chat as seen."""
+        record = self._records.get(key)
+        now = time.monotonic()
+        if record is None or record.loaded_at is None or (self.ttl and record.loaded_at + self.ttl < now):
+            self.misses += 1
+            return None
+        record.last_seen = now
+        self._records.move_to_end(key)
+        self.hits += 1
+        return record
+
+    def get_or_create(self, key: Hashable) -> UserState:
+        """Returns the chat's record, adding an unloaded one if it isn't resident, without reading Redis."""
+        now = time.monotonic()
+        record = self._records.get(key)
+        if record is None:
+            return self._add(key, UserState(last_seen=now))
+        record.last_seen = now
+        self._records.move_to_end(key)
+        return record
+
+    def hydrate(self, key: Hashable, language: Optional[str]) -> UserState:
+        """Stores the chat's state as just read from (or written to) Redis."""
+        now = time.monotonic()
+        return self._add(key, UserState(language, now, now))
+
+    def _add(self, key: Hashable, record: UserState) -> UserState:
+        if self._records.pop(key, None) is None:
+            self._bytes += _entry_size(key)
+        self._records[key] = record
+        self._evict(record.last_seen)
+        return record
+
+    def pop(self, key: Hashable) -> Optional[UserState]:
+        record = self._records.pop(key, None)
+        if record is not None:
+            self._bytes -= _entry_size(key)
+        return record
+
+    def clear(self) -> None:
+        self._records.clear()
+        self._bytes = 0
+
+    def _evict(self, now: float) -> None:
+        while self._records:
+            key, oldest = next(iter(self._records.items()))
+            if len(self._records) <= self.max_users and self._bytes <= self.max_bytes \
+                    and not (self.idle_ttl and oldest.last_seen + self.idle_ttl < now):
+                return
+            self.pop(key)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> dict:
+        return {"resident_users": len(self._records), "resident_bytes": self._bytes,
+                "max_users": self.max_users, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# chat_id -> UserState, the in-memory side of the Redis session store in `memory.session`
+user_states = UserStateStore()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Long polling ingress, used when `SERVING_MODE=polling`.
+
+For deployments without a public URL, and as a failover while the webhook
+ingress is down: the bot removes its webhook and fetches updates with
+`getUpdates`, handling them with the same handlers as the webhook server.
+Fetched updates are appended to the Redis update stream before Telegram is
+told to forget them, and handled from there by a consumer in this process
+(and by any `worker.py` running), so a slow update never holds up the ones
+behind it and a restart loses nothing. Starting the webhook server registers
+the webhook again.
+
+Usage:
+    SERVING_MODE=polling python src/main.py
+"""
+import asyncio
+import contextlib
+from typing import AsyncIterator, Optional, Tuple
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from telegram import Update
+from telegram.error import Conflict, NetworkError, TelegramError
+from telegram.ext import Application
+
+from core.config import settings
+from core.logger import logger
+from core.admission import admission
+from core.coordinator import chat_coordinator
+from core.metrics import METRICS_CONTENT_TYPE, bind_queue_gauges, mark_received, render_metrics
+from core.resilience import agent_guard
+from handlers import build_application, init_resources, close_resources
+from broadcast import broadcaster
+from memory.answer_cache import answer_cache
+from memory.feedback_sink import feedback_sink
+from memory.update_stream import UpdateStreamConsumer, publish_updates
+from memory.user_state import user_states
+from utils.update_util import HANDLED_UPDATE_TYPES
+from utils.voice_util import voice_file_urls
+
+
+class UpdatePoller:
+    """
+    Fetches updates with `getUpdates` into the update stream, and handles them from there.
+
+    The offset sent with every call confirms all updates below it to
+    Telegram, so it only moves past updates once they are in the stream.
+    While every handling slot is taken the poller stops fetching, leaving the
+    updates with Telegram, instead of piling them up in the stream.
+    """
+
+    def __init__(
+            self,
+            application: Application,
+            limit: int = settings.POLLING_LIMIT,
+            timeout: int = settings.POLLING_TIMEOUT,
+            busy_interval: float = settings.POLLING_BUSY_INTERVAL,
+    ) -> None:
+        self.application = application
+        self.limit = limit
+        self.timeout = timeout
+        self.busy_interval = busy_interval
+        self.consumer = UpdateStreamConsumer(self._handle)
+        # Every update below it is in the stream
+        self.offset = 0
+        self._stopping = asyncio.Event()
+        # Set once the webhook is removed and polling began, until polling stops
+        self.ready = False
+        self.polls = 0
+        self.published = 0
+        self.paused = 0
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Polls updates until `stop` is called, then waits for the ones being handled."""
+        # Telegram refuses getUpdates while a webhook is set
+        await self.application.bot.delete_webhook()
+        consumer = asyncio.create_task(self.consumer.run(), name="update_stream_consumer")
+        logger.info({"category": "poller", "label": "polling_started", "value": self.limit})
+        self.ready = True
+        try:
+            while not self._stopping.is_set():
+                if self.consumer.saturated:
+                    # Telegram keeps the updates until there is room to handle them
+                    self.paused += 1
+                    await asyncio.sleep(self.busy_interval)
+                    continue
+                try:
+                    updates = await self._poll()
+                except Conflict as e:
+                    # Another poller runs with this token, or a webhook was set meanwhile
+                    logger.error({"category": "poller", "label": "poll_conflict", "value": str(e)})
+                    await asyncio.sleep(1)
+                    continue
+                except NetworkError as e:
+                    logger.warning({"category": "poller", "label": "poll_failed", "value": str(e)})
+                    await asyncio.sleep(1)
+                    continue
+                if updates is None:
+                    break
+                self.polls += 1
+                if updates and not await self._publish(updates):
+                    # Not in the stream, so the same updates are fetched again
+                    await asyncio.sleep(1)
+        except Exception as e:
+            # E.g. a revoked token; `/healthcheck` reports the poller as stopped from here on
+            logger.error({"category": "poller", "label": "polling_failed", "value": str(e)})
+            raise
+        finally:
+            self.ready = False
+            self.consumer.stop()
+            await asyncio.gather(consumer, return_exceptions=True)
+            await self._confirm()
+            logger.info({"category": "poller", "label": "polling_stopped", "value": self.consumer.handled})
+
+    async def _poll(self) -> Optional[Tuple[Update, ...]]:
+        """Calls getUpdates, or returns None when `stop` is called while the call waits for updates."""
+        poll = asyncio.create_task(self.application.bot.get_updates(
+            offset=self.offset, limit=self.limit, timeout=self.timeout, allowed_updates=HANDLED_UPDATE_TYPES))
+        stopping = asyncio.create_task(self._stopping.wait())
+        await asyncio.wait({poll, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not poll.done():
+            poll.cancel()
+            await asyncio.gather(poll, return_exceptions=True)
+            return None
+        return poll.result()
+
+    async def _publish(self, updates: Tuple[Update, ...]) -> bool:
+        """Appends the updates to the stream and moves the offset past them, returning whether that worked."""
+        try:
+            await publish_updates([update.to_json().encode('utf-8') for update in updates])
+        except Exception as e:
+            logger.error({"category": "poller", "label": "publish_failed", "value": str(e)})
+            return False
+        for update in updates:
+            update_type = next((name for name in HANDLED_UPDATE_TYPES if getattr(update, name) is not None), None)
+            mark_received(update.update_id, update_type)
+        self.offset = updates[-1].update_id + 1
+        self.published += len(updates)
+        return True
+
+    async def _handle(self, data: dict) -> None:
+        await self.application.process_update(Update.de_json(data=data, bot=self.application.bot))
+
+    async def _confirm(self) -> None:
+        """Confirms the updates in the stream on shutdown, which the next poll would otherwise do."""
+        try:
+            await self.application.bot.get_updates(offset=self.offset, limit=1, timeout=0,
+                                                   allowed_updates=HANDLED_UPDATE_TYPES)
+        except TelegramError as e:
+            logger.warning({"category": "poller", "label": "confirm_failed", "value": str(e)})
+
+    def stats(self) -> dict:
+        return {"offset": self.offset, "polls": self.polls, "published": self.published, "paused": self.paused,
+                **self.consumer.stats()}
+
+
+async def main() -> None:
+    logger.info('################################################')
+    logger.info('# Telegram bot name %s, long polling', settings.TELEGRAM_BOT_NAME)
+    logger.info('################################################')
+    # Handlers block so that a stream entry is only acknowledged after it was handled
+    application = build_application(block=True)
+    poller = UpdatePoller(application)
+
+    bind_queue_gauges(lambda: application.bot.rate_limiter.queue_depth)
+
+    polling: Optional[asyncio.Task] = None
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_: Starlette) -> AsyncIterator[None]:
+        # Run inside `serve`, since uvicorn re-raises the stop signal once `serve` returns
+        nonlocal polling
+        async with application:
+            background_tasks = await init_resources(application.bot)
+            await application.start()
+            polling = asyncio.create_task(poller.run(), name="update_poller")
+            try:
+                yield
+            finally:
+                poller.stop()
+                await asyncio.gather(polling, return_exceptions=True)
+                await application.stop()
+                await close_resources(background_tasks)
+
+    async def health(_: Request) -> PlainTextResponse:
+        if polling is None or polling.done():
+            return PlainTextResponse(content="Polling stopped", status_code=503)
+        return PlainTextResponse(content="The bot is still running fine :)")
+
+    async def ready(_: Request) -> PlainTextResponse:
+        if not poller.ready:
+            return PlainTextResponse(content="Not polling", status_code=503)
+        return PlainTextResponse(content="Ready")
+
+    async def metrics(_: Request) -> Response:
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+    async def stats(_: Request) -> JSONResponse:
+        return JSONResponse({
+            "poller": poller.stats(),
+            "rate_limiter": application.bot.rate_limiter.stats(),
+            "user_state": user_states.stats(),
+            "answer_cache": answer_cache.stats(),
+            "voice_files": voice_file_urls.stats(),
+            "feedback": feedback_sink.stats(),
+            "broadcast": broadcaster.stats(),
+            "kb_agent": agent_guard.stats(),
+            "admission": admission.stats(),
+            "coordinator": chat_coordinator.stats(),
+        })
+
+    # No webhook to serve, the server only reports health, readiness, metrics and stats
+    webserver = uvicorn.Server(
+        config=uvicorn.Config(
+            app=Starlette(lifespan=lifespan, routes=[
+                Route("/healthcheck", health, methods=["GET"]),
+                Route("/readyz", ready, methods=["GET"]),
+                Route("/metrics", metrics, methods=["GET"]),
+                Route("/stats", stats, methods=["GET"]),
+            ]),
+            port=8000,
+            use_colors=False,
+            # Access and server logs go through the app's logging, written by its background thread
+            log_config=None,
+            host="0.0.0.0",
+        )
+    )
+    await webserver.serve()
+
+
+def run_poller() -> None:
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run_poller()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# This program is dedicated to the public domain under the CC0 license.
+# pylint: disable=import-error,unused-argument
+"""
+Webhook server, used when `SERVING_MODE=single` (the default).
+
+Telegram posts updates to `/telegram`, which hands them to the in-process
+application or, with `WEBHOOK_INGESTION_MODE=stream`, appends them to the
+Redis update stream for `worker.py`. Serves the health, readiness, metrics
+and stats endpoints next to it.
+
+Usage:
+    python src/main.py
+"""
+import asyncio
+import contextlib
+from typing import AsyncIterator, Optional
+
+import uvicorn
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from telegram import Update
+
+from core.config import settings
+from core.logger import logger
+from core.admission import admission
+from core.coordinator import chat_coordinator
+from core.dedup import create_deduplicator
+from core.metrics import METRICS_CONTENT_TYPE, bind_queue_gauges, count_update, mark_received, render_metrics
+from core.resilience import agent_guard
+from core.webhook import register_webhook
+from handlers import build_application, init_resources, close_resources
+from broadcast import broadcaster
+from memory.answer_cache import answer_cache
+from memory.feedback_sink import feedback_sink
+from memory.user_state import user_states
+from memory.update_stream import publish_update
+from utils.update_util import SECRET_TOKEN_HEADER, get_update_type, is_authentic, is_handled, parse_update
+from utils.voice_util import voice_file_urls
+
+
+async def main() -> None:
+    """Set up PTB application and a web application for handling the incoming requests."""
+    logger.info('################################################')
+    logger.info('# Telegram bot name %s', settings.TELEGRAM_BOT_NAME)
+    logger.info('################################################')
+    application = build_application()
+    # Registers the webhook with telegram, if it changed, once the server is up
+    registration: Optional[asyncio.Task] = None
+
+    bind_queue_gauges(lambda: application.bot.rate_limiter.queue_depth)
+
+    # Telegram retries updates when we are slow to answer, those retries are dropped here
+    deduplicator = create_deduplicator()
+
+    # Set up webserver
+    async def telegram(request: Request) -> Response:
+        """Handle incoming Telegram updates by putting them into the `update_queue`"""
+        # Checked before reading the body, so requests not coming from Telegram cost next to nothing
+        if not is_authentic(request.headers.get(SECRET_TOKEN_HEADER)):
+            return Response(status_code=403)
+        body = parse_update(await request.body())
+        if body is None:
+            return Response(status_code=400)
+        update_type = get_update_type(body)
+        if not is_handled(body, update_type):
+            # Acknowledged without building the `Update`, no handler would act on it
+            count_update(update_type)
+            return Response()
+        # Refused before deduplication so that Telegram's retry of this update is not dropped
+        if not admission.admit(update_type):
+            return Response(status_code=503, headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)})
+        if await deduplicator.is_duplicate(body["update_id"]):
+            return Response()
+        mark_received(body["update_id"], update_type)
+        admission.hold(body["update_id"])
+        await application.update_queue.put(
+            Update.de_json(data=body, bot=application.bot)
+        )
+        return Response()
+
+    async def telegram_to_stream(request: Request) -> Response:
+        """Handle incoming Telegram updates by appending them to the Redis update stream"""
+        if not is_authentic(request.headers.get(SECRET_TOKEN_HEADER)):
+            return Response(status_code=403)
+        raw_body = await request.body()
+        body = parse_update(raw_body)
+        if body is None:
+            return Response(status_code=400)
+        update_type = get_update_type(body)
+        count_update(update_type)
+        if not is_handled(body, update_type) or await deduplicator.is_duplicate(body["update_id"]):
+            return Response()
+        try:
+            await publish_update(raw_body)
+        except Exception:
+            # Not in the stream, so Telegram's retry of this update must not be dropped as a duplicate
+            await deduplicator.forget(body["update_id"])
+            raise
+        return Response()
+
+    async def health(_: Request) -> PlainTextResponse:
+        """For the health endpoint, reply with a simple plain text message."""
+        return PlainTextResponse(content="The bot is still running fine :)")
+
+    async def ready(_: Request) -> PlainTextResponse:
+        """Ready for traffic once the application started and the webhook is registered."""
+        if registration is None or not registration.done() or registration.cancelled() \
+                or registration.exception() is not None:
+            return PlainTextResponse(content="Starting", status_code=503)
+        return PlainTextResponse(content="Ready")
+
+    async def metrics(_: Request) -> Response:
+        """Exposes the Prometheus metrics of this process."""
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+    async def stats(_: Request) -> JSONResponse:
+        """Reports the counters of the in-process caches and queues."""
+        return JSONResponse({
+            "dedup": deduplicator.stats(),
+            "rate_limiter": application.bot.rate_limiter.stats(),
+            "user_state": user_states.stats(),
+            "answer_cache": answer_cache.stats(),
+            "voice_files": voice_file_urls.stats(),
+            "feedback": feedback_sink.stats(),
+            "broadcast": broadcaster.stats(),
+            "kb_agent": agent_guard.stats(),
+            "admission": admission.stats(),
+            "coordinator": chat_coordinator.stats(),
+        })
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_: Starlette) -> AsyncIterator[None]:
+        # Run inside `serve`, since uvicorn re-raises the stop signal once `serve` returns
+        nonlocal registration
+        async with application:
+            background_tasks = await init_resources(application.bot)
+            await application.start()
+            registration = asyncio.create_task(register_webhook(application.bot), name="webhook_registration")
+            try:
+                yield
+            finally:
+                registration.cancel()
+                await asyncio.gather(registration, return_exceptions=True)
+                await application.stop()
+                await close_resources(background_tasks)
+
+    starlette_app = Starlette(
+        lifespan=lifespan,
+        routes=[
+            Route("/telegram", telegram_to_stream if settings.WEBHOOK_INGESTION_MODE == "stream" else telegram,
+                  methods=["POST"]),
+            Route("/healthcheck", health, methods=["GET"]),
+            Route("/readyz", ready, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+            Route("/stats", stats, methods=["GET"]),
+        ]
+    )
+    webserver = uvicorn.Server(
+        config=uvicorn.Config(
+            app=starlette_app,
+            port=8000,
+            use_colors=False,
+            # Access and server logs go through the app's logging, written by its background thread
+            log_config=None,
+            host="0.0.0.0",
+        )
+    )
+
+    # Run application and webserver together, the application starts and stops with the webserver's lifespan
+    await webserver.serve()
+
+
+def run_server() -> None:
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run_server()
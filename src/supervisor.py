@@ -0,0 +1,260 @@
+"""
+Multi-process webhook serving, used when `SERVING_MODE=multiprocess`.
+
+The supervisor process registers the webhook once, receives the updates on
+`/telegram` and shards them by chat id over `UVICORN_WORKERS` worker
+processes. Every worker runs its own PTB `Application` with the shared
+handlers, so all updates of a chat are handled, in order of arrival, by the
+same worker and its caches. Workers report a heartbeat; `/healthcheck`
+aggregates them and the supervisor restarts workers that died.
+"""
+import asyncio
+import contextlib
+import multiprocessing
+import queue
+import signal
+import time
+from multiprocessing.context import SpawnProcess
+from multiprocessing.sharedctypes import Synchronized
+from typing import AsyncIterator, List, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from telegram import Bot, Update
+
+from core.config import settings
+from core.logger import logger
+from core.admission import admission
+from core.dedup import create_deduplicator
+from core.metrics import (METRICS_CONTENT_TYPE, bind_queue_gauges, count_update, mark_process_dead,
+                          refresh_gauges, remove_multiprocess_dir, render_metrics)
+from core.webhook import register_webhook
+from utils.update_util import (SECRET_TOKEN_HEADER, get_update_chat_id, get_update_type, is_authentic, is_handled,
+                               json_loads, parse_update)
+
+_STOP = None
+# Seconds between checks whether a worker above its hard watermark has room again
+ADMISSION_WAIT_INTERVAL = 0.05
+
+
+def run_worker(index: int, updates: multiprocessing.Queue, heartbeat: Synchronized) -> None:
+    """Entry point of a worker process."""
+    # Shutdown is driven by the supervisor, which sends every worker a stop marker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, updates, heartbeat))
+
+
+async def _worker_main(index: int, updates: multiprocessing.Queue, heartbeat: Synchronized) -> None:
+    # Imported here, the supervisor itself has no use for the handlers and their clients
+    from handlers import build_application, init_resources, close_resources
+
+    application = build_application()
+    bind_queue_gauges(lambda: application.bot.rate_limiter.queue_depth)
+
+    async def beat() -> None:
+        while True:
+            heartbeat.value = time.time()
+            refresh_gauges()
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_INTERVAL)
+
+    async with application:
+        background_tasks = await init_resources(application.bot)
+        await application.start()
+        background_tasks.append(asyncio.create_task(beat(), name="worker_heartbeat"))
+        logger.info({"category": "supervisor", "label": "worker_started", "value": index})
+        try:
+            while True:
+                # Updates stay in the bounded queue meanwhile, so the webhook answers 503 once it is full
+                while admission.enabled and admission.load >= admission.hard_watermark:
+                    await asyncio.sleep(ADMISSION_WAIT_INTERVAL)
+                raw_update = await asyncio.to_thread(updates.get)
+                if raw_update is _STOP:
+                    break
+                data = json_loads(raw_update)
+                admission.hold(data["update_id"])
+                await application.update_queue.put(Update.de_json(data=data, bot=application.bot))
+        finally:
+            await application.stop()
+            await close_resources(background_tasks)
+            logger.info({"category": "supervisor", "label": "worker_stopped", "value": index})
+
+
+class WorkerHandle:
+    """Supervisor side of one worker: its process, inbound queue and heartbeat."""
+
+    def __init__(self, index: int, context: multiprocessing.context.SpawnContext):
+        self.index = index
+        self.context = context
+        self.updates: multiprocessing.Queue = context.Queue(maxsize=settings.WORKER_QUEUE_SIZE)
+        self.heartbeat: Synchronized = context.Value('d', 0.0)
+        self.process: Optional[SpawnProcess] = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self.heartbeat.value = self.started_at
+        self.process = self.context.Process(target=run_worker, args=(self.index, self.updates, self.heartbeat),
+                                            name=f"bot-worker-{self.index}", daemon=True)
+        self.process.start()
+
+    def is_healthy(self) -> bool:
+        return (self.process is not None and self.process.is_alive()
+                and time.time() - self.heartbeat.value < settings.WORKER_HEARTBEAT_TIMEOUT)
+
+    def is_ready(self) -> bool:
+        """Healthy and beating since its application started, which is when the worker starts its heartbeat."""
+        return self.is_healthy() and self.heartbeat.value > self.started_at
+
+    def stop(self, timeout: float) -> None:
+        if self.process is None:
+            return
+        try:
+            # Behind the updates still queued, which the worker handles before it stops
+            self.updates.put(_STOP, timeout=timeout)
+            self.process.join(timeout)
+        except queue.Full:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def status(self) -> dict:
+        return {
+            "worker": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "healthy": self.is_healthy(),
+            "ready": self.is_ready(),
+            "heartbeat_age": round(time.time() - self.heartbeat.value, 3),
+            "restarts": self.restarts,
+        }
+
+
+class Supervisor:
+    def __init__(self, worker_count: int = settings.UVICORN_WORKERS):
+        context = multiprocessing.get_context("spawn")
+        self.workers: List[WorkerHandle] = [WorkerHandle(index, context) for index in range(max(worker_count, 1))]
+        self.deduplicator = create_deduplicator()
+        # Registers the webhook with telegram, if it changed, once the server is up
+        self.registration: Optional[asyncio.Task] = None
+
+    def shard(self, data: dict) -> WorkerHandle:
+        chat_id = get_update_chat_id(data)
+        key = chat_id if chat_id is not None else data["update_id"]
+        return self.workers[key % len(self.workers)]
+
+    async def monitor(self) -> None:
+        """Restarts workers whose process exited."""
+        while True:
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_INTERVAL)
+            for worker in self.workers:
+                if worker.process is not None and not worker.process.is_alive():
+                    logger.error({"category": "supervisor", "label": "worker_died", "value": worker.index,
+                                  "exitcode": worker.process.exitcode})
+                    mark_process_dead(worker.process.pid)
+                    worker.restarts += 1
+                    worker.start()
+
+    def build_app(self) -> Starlette:
+        async def telegram(request: Request) -> Response:
+            """Handle incoming Telegram updates by handing them to the worker that owns the chat"""
+            if not is_authentic(request.headers.get(SECRET_TOKEN_HEADER)):
+                return Response(status_code=403)
+            raw_body = await request.body()
+            body = parse_update(raw_body)
+            if body is None:
+                return Response(status_code=400)
+            update_type = get_update_type(body)
+            count_update(update_type)
+            if not is_handled(body, update_type) or await self.deduplicator.is_duplicate(body["update_id"]):
+                return Response()
+            try:
+                self.shard(body).updates.put_nowait(raw_body)
+            except queue.Full:
+                # The worker is behind; Telegram's retry of this update must not be dropped as a duplicate
+                await self.deduplicator.forget(body["update_id"])
+                return Response(status_code=503)
+            return Response()
+
+        async def health(_: Request) -> JSONResponse:
+            """Healthy only while every worker is alive and sending heartbeats."""
+            workers = [worker.status() for worker in self.workers]
+            healthy = all(worker["healthy"] for worker in workers)
+            return JSONResponse({"healthy": healthy, "workers": workers}, status_code=200 if healthy else 503)
+
+        async def ready(_: Request) -> JSONResponse:
+            """Ready once the webhook is registered and every worker's application started."""
+            registered = self.registration is not None and self.registration.done() \
+                and not self.registration.cancelled() and self.registration.exception() is None
+            workers_ready = all(worker.is_ready() for worker in self.workers)
+            return JSONResponse({"webhook_registered": registered, "workers_ready": workers_ready},
+                                status_code=200 if registered and workers_ready else 503)
+
+        async def stats(_: Request) -> JSONResponse:
+            return JSONResponse({"dedup": self.deduplicator.stats()})
+
+        async def metrics(_: Request) -> Response:
+            """Metrics of the supervisor and every worker, which don't serve HTTP themselves."""
+            return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+        return Starlette(
+            lifespan=self.lifespan,
+            routes=[
+                Route("/telegram", telegram, methods=["POST"]),
+                Route("/healthcheck", health, methods=["GET"]),
+                Route("/readyz", ready, methods=["GET"]),
+                Route("/stats", stats, methods=["GET"]),
+                Route("/metrics", metrics, methods=["GET"]),
+            ]
+        )
+
+    async def serve(self) -> None:
+        logger.info('################################################')
+        logger.info('# Telegram bot name %s, %d workers', settings.TELEGRAM_BOT_NAME, len(self.workers))
+        logger.info('################################################')
+        webserver = uvicorn.Server(
+            config=uvicorn.Config(
+                app=self.build_app(),
+                port=8000,
+                use_colors=False,
+                # Access and server logs go through the app's logging, written by its background thread
+                log_config=None,
+                host="0.0.0.0",
+            )
+        )
+        await webserver.serve()
+
+    async def register_webhook(self) -> None:
+        # Registered once here rather than by every worker
+        bot = Bot(settings.TELEGRAM_BOT_TOKEN, base_url=settings.TELEGRAM_API_BASE_URL,
+                  base_file_url=settings.TELEGRAM_API_BASE_FILE_URL)
+        try:
+            await register_webhook(bot)
+        finally:
+            await bot.shutdown()
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, _: Starlette) -> AsyncIterator[None]:
+        """Runs the workers while the webserver serves; uvicorn re-raises the stop signal once `serve` returns."""
+        for worker in self.workers:
+            worker.start()
+        monitor = asyncio.create_task(self.monitor(), name="supervisor_monitor")
+        self.registration = asyncio.create_task(self.register_webhook(), name="webhook_registration")
+        try:
+            yield
+        finally:
+            self.registration.cancel()
+            monitor.cancel()
+            await asyncio.gather(self.registration, monitor, return_exceptions=True)
+            for worker in self.workers:
+                await asyncio.to_thread(worker.stop, settings.WORKER_SHUTDOWN_TIMEOUT)
+            remove_multiprocess_dir()
+
+
+def run_supervisor() -> None:
+    asyncio.run(Supervisor().serve())
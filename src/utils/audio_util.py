@@ -0,0 +1,113 @@
+import hashlib
+from typing import Dict, Optional
+
+from redis.exceptions import RedisError
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from core.config import settings
+from core.http_client import get_agent_client
+from core.logger import logger
+from core.metrics import AUDIO_DOWNLOAD_LATENCY
+from memory.redis import redis_client
+
+AUDIO_FILE_ID_PREFIX = "audio_file_id:"
+
+
+class AudioTooLargeError(Exception):
+    """Raised when the agent audio is bigger than `AUDIO_MAX_BYTES`."""
+
+
+def url_cache_key(audio_url: str) -> str:
+    return AUDIO_FILE_ID_PREFIX + "url:" + hashlib.sha256(audio_url.encode('utf-8')).hexdigest()
+
+
+def content_cache_key(audio_data: bytes) -> str:
+    return AUDIO_FILE_ID_PREFIX + "sha256:" + hashlib.sha256(audio_data).hexdigest()
+
+
+async def download_audio(audio_url: str, max_bytes: int = settings.AUDIO_MAX_BYTES) -> bytes:
+    """Streams the audio file into memory, aborting once it grows past `max_bytes`."""
+    with AUDIO_DOWNLOAD_LATENCY.time():
+        return await _download_audio(audio_url, max_bytes)
+
+
+async def _download_audio(audio_url: str, max_bytes: int) -> bytes:
+    async with get_agent_client().stream("GET", audio_url, timeout=settings.AUDIO_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise AudioTooLargeError(f"Audio of {content_length} bytes exceeds the {max_bytes} bytes limit")
+        audio_data = bytearray()
+        async for chunk in response.aiter_bytes():
+            audio_data += chunk
+            if len(audio_data) > max_bytes:
+                raise AudioTooLargeError(f"Audio exceeds the {max_bytes} bytes limit")
+        return bytes(audio_data)
+
+
+def _sent_file_id(message: Message) -> Optional[str]:
+    attachment = message.voice or message.audio or message.document
+    return attachment.file_id if attachment else None
+
+
+async def _cached_file_id(key: str) -> Optional[str]:
+    """The cached `file_id`, None when there is none or Redis is unreachable, which only costs an upload."""
+    try:
+        file_id = await redis_client.get(key)
+    except RedisError as e:
+        logger.warning({"category": "audio", "label": "file_id_get_failed", "value": str(e)})
+        return None
+    return file_id.decode('utf-8') if file_id is not None else None
+
+
+async def _cache_file_id(mapping: Dict[str, str]) -> None:
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, file_id in mapping.items():
+                pipe.set(key, file_id, ex=settings.AUDIO_FILE_ID_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning({"category": "audio", "label": "file_id_set_failed", "value": str(e)})
+
+
+async def _send_cached(bot: Bot, chat_id: int, key: str) -> Optional[str]:
+    """Sends the voice by a cached `file_id`, returning None if there is none or it was rejected."""
+    file_id = await _cached_file_id(key)
+    if file_id is None:
+        return None
+    try:
+        await bot.send_voice(chat_id=chat_id, voice=file_id)
+        return file_id
+    except BadRequest as e:
+        logger.warning({"category": "audio", "label": "stale_file_id", "value": str(e)})
+        try:
+            await redis_client.delete(key)
+        except RedisError as redis_error:
+            logger.warning({"category": "audio", "label": "file_id_delete_failed", "value": str(redis_error)})
+        return None
+
+
+async def send_agent_audio(bot: Bot, chat_id: int, audio_url: str) -> None:
+    """
+    Sends the agent TTS audio as a voice message.
+
+    Audio that was already uploaded once is re-sent by its Telegram `file_id`,
+    looked up first by URL and then, after download, by content hash. Only
+    audio Telegram has never seen is uploaded.
+    """
+    url_key = url_cache_key(audio_url)
+    if await _send_cached(bot, chat_id, url_key):
+        return
+
+    audio_data = await download_audio(audio_url)
+    content_key = content_cache_key(audio_data)
+    file_id = await _send_cached(bot, chat_id, content_key)
+    if file_id:
+        await _cache_file_id({url_key: file_id})
+        return
+
+    message = await bot.send_voice(chat_id=chat_id, voice=audio_data)
+    file_id = _sent_file_id(message)
+    if file_id:
+        await _cache_file_id({url_key: file_id, content_key: file_id})
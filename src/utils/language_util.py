@@ -1,47 +1,125 @@
-import glob
+import asyncio
 import json
+import os
 from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
 from core.logger import logger
 from core.config import settings
-import os
 
-language_dict = {}
+# Resolved against this package, so the bot can be started from any working directory
+LANGUAGES_DIR = Path(__file__).resolve().parent.parent / "languages"
+
 default_lang = settings.DEFAULT_LANGUAGE
-languages_array = []
+
+# The languages offered to users, in keyboard order; settings don't change at runtime
+SUPPORTED_LANGUAGES: Tuple[Mapping[str, Any], ...] = tuple(
+    MappingProxyType(language) for language in settings.LANGUAGES
+    if language.get("code") in settings.SUPPORTED_LANGUAGES.split(",")
+)
+
+CatalogKey = Tuple[str, str, Optional[str]]
+
+# (language, key, bot_id) -> message, with the fallback to the default language already applied
+_catalog: Mapping[CatalogKey, Any] = MappingProxyType({})
+_catalog_mtimes: Dict[str, float] = {}
+_reported_misses = set()
+
+
+def _language_files() -> Dict[str, float]:
+    """Returns the language files and their modification times."""
+    with os.scandir(LANGUAGES_DIR) as entries:
+        return {entry.path: entry.stat().st_mtime for entry in entries if entry.name.endswith(".json")}
+
+
+def _freeze(message: Any) -> Any:
+    if isinstance(message, dict):
+        return MappingProxyType({key: _freeze(value) for key, value in message.items()})
+    if isinstance(message, list):
+        return tuple(_freeze(value) for value in message)
+    return message
+
+
+def compile_catalog(languages: Dict[str, dict], default: str = default_lang) -> Mapping[CatalogKey, Any]:
+    """
+    Flattens the language files into a read-only lookup table.
+
+    Every language gets every key of every file: a message missing from a
+    language falls back to the default language. Messages that are dicts of
+    per-bot variants are also stored per `bot_id`, with the same fallback.
+    """
+    defaults = languages.get(default, {})
+    keys = set().union(*(messages.keys() for messages in languages.values())) if languages else set()
+    catalog = {}
+    for language, messages in languages.items():
+        for key in keys:
+            message = messages.get(key) or defaults.get(key)
+            if not message:
+                continue
+            catalog[(language, key, None)] = _freeze(message)
+            if isinstance(message, dict):
+                default_variants = defaults.get(key) if isinstance(defaults.get(key), dict) else {}
+                for bot_id in set(message) | set(default_variants):
+                    variant = message.get(bot_id) or default_variants.get(bot_id)
+                    if variant:
+                        catalog[(language, key, bot_id)] = _freeze(variant)
+    return MappingProxyType(catalog)
+
 
 def language_init():
-    """Loads language JSON files and builds the language dictionary."""
-    
-    BASE_DIR = Path("./src/languages/*.json")
+    """Loads the language JSON files and compiles the message catalog."""
+    global _catalog, _catalog_mtimes
+    mtimes = _language_files()
+    languages = {}
+    for path in mtimes:
+        with open(path, 'r', encoding='utf-8') as f:
+            languages[Path(path).stem] = json.load(f)
+    _catalog = compile_catalog(languages)
+    _catalog_mtimes = mtimes
+    _reported_misses.clear()
+
+
+def reload_if_changed() -> bool:
+    """Recompiles the catalog when a language file was added, removed or modified."""
+    if _language_files() == _catalog_mtimes:
+        return False
+    language_init()
+    logger.info({"category": "language_util", "label": "catalog_reloaded", "value": len(_catalog)})
+    return True
+
+
+async def language_reloader(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(reload_if_changed)
+        except (OSError, ValueError) as e:
+            # A half-written file fails to parse; the current catalog stays until the next check
+            logger.warning({"category": "language_util", "label": "catalog_reload_failed", "value": str(e)})
+
+
+def start_language_reloader() -> Optional[asyncio.Task]:
+    """Watches the language files for changes, unless `LANGUAGE_RELOAD_INTERVAL` is 0."""
+    if settings.LANGUAGE_RELOAD_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(language_reloader(settings.LANGUAGE_RELOAD_INTERVAL), name="language_reloader")
 
-    for filename in glob.glob(str(BASE_DIR)):
-        lang_code = filename.split('/')[-1].split('.')[0]
-        with open(filename, 'r') as f:
-            language_dict[lang_code] = json.load(f)
 
 def get_message(language=default_lang, key=None, bot_id=None):
-    """Retrieves a message from the language dictionary, handling fallbacks."""
-
-    message = None
-    try:
-        if bot_id:
-            message = language_dict[language].get(key, {}).get(bot_id)
-        if not message:
-            message = language_dict[language].get(key)
-        if message:
-            return json.loads(json.dumps(message))
-    except KeyError:
-        logger.warn(f"❌ Object doesn't exist for {language}.{key}")
-        logger.info(f"Getting default language (en) message for key: {key}")
-        if bot_id:
-            message = language_dict[default_lang].get(key, {}).get(bot_id)
-        if not message:
-            message = language_dict[default_lang].get(key)
-        if message:
-            return json.loads(json.dumps(message))
-    return None
+    """Retrieves a message from the compiled catalog, falling back to the default language."""
+    message = _catalog.get((language, key, bot_id))
+    if message is not None:
+        return message
+    # Unknown bot or language: the same lookups the catalog resolves ahead of time for known ones
+    message = _catalog.get((language, key, None)) or _catalog.get((default_lang, key, bot_id)) \
+        or _catalog.get((default_lang, key, None))
+    if (language, key) not in _reported_misses and len(_reported_misses) < 1000:
+        _reported_misses.add((language, key))
+        logger.warning({"category": "language_util", "label": "message_missing", "value": f"{language}.{key}",
+                        "bot_id": bot_id, "fallback": message is not None})
+    return message
+
 
 def get_languages():
-    """Returns the global languages array."""
-    languages = settings.SUPPORTED_LANGUAGES.split(",")
-    return list(filter(lambda x: x.get("code") in languages , settings.LANGUAGES))
\ No newline at end of file
+    """Returns the supported languages."""
+    return SUPPORTED_LANGUAGES
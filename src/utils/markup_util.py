@@ -0,0 +1,74 @@
+from typing import Dict, Tuple, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from utils.language_util import get_languages
+
+# Stands in for the per-message id in the `callback_data` of keyboard templates
+ID_PLACEHOLDER = "{id}"
+
+
+class MarkupTemplate:
+    """A keyboard of callback buttons in which only the message id in the callback data changes per message."""
+
+    def __init__(self, markup: InlineKeyboardMarkup):
+        self._rows: Tuple[Tuple[Tuple[str, str], ...], ...] = tuple(
+            tuple((button.text, button.callback_data) for button in row) for row in markup.inline_keyboard
+        )
+
+    def render(self, message_id: Union[int, str]) -> InlineKeyboardMarkup:
+        message_id = str(message_id)
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(text, callback_data=data.replace(ID_PLACEHOLDER, message_id)) for text, data in row]
+            for row in self._rows
+        ])
+
+
+class MarkupRegistry:
+    """
+    Keeps the bot's inline keyboards, so they are built once per process.
+
+    Telegram objects can't be changed once built, so one keyboard object is
+    sent with every message that shows it.
+    """
+
+    def __init__(self):
+        self._static: Dict[str, InlineKeyboardMarkup] = {}
+        self._templates: Dict[str, MarkupTemplate] = {}
+
+    def register(self, name: str, markup: InlineKeyboardMarkup) -> None:
+        self._static[name] = markup
+
+    def register_template(self, name: str, markup: InlineKeyboardMarkup) -> None:
+        self._templates[name] = MarkupTemplate(markup)
+
+    def get(self, name: str) -> InlineKeyboardMarkup:
+        return self._static[name]
+
+    def render(self, name: str, message_id: Union[int, str]) -> InlineKeyboardMarkup:
+        return self._templates[name].render(message_id)
+
+
+def language_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text=language["text"], callback_data=f"lang_{language['code']}")]
+        for language in get_languages()
+    ])
+
+
+markups = MarkupRegistry()
+markups.register("language", language_keyboard())
+# 👍🏻/👎🏻 under an answer, the callback data carries the id of the question
+markups.register_template("feedback", InlineKeyboardMarkup([[
+    InlineKeyboardButton("👍🏻", callback_data=f"message-liked__{ID_PLACEHOLDER}"),
+    InlineKeyboardButton("👎🏻", callback_data=f"message-disliked__{ID_PLACEHOLDER}"),
+]]))
+# The same keyboard once the user voted, with the chosen button highlighted
+markups.register("feedback_liked", InlineKeyboardMarkup([[
+    InlineKeyboardButton("👍", callback_data="replymessage_liked"),
+    InlineKeyboardButton("👎🏻", callback_data="replymessage_disliked"),
+]]))
+markups.register("feedback_disliked", InlineKeyboardMarkup([[
+    InlineKeyboardButton("👍🏻", callback_data="replymessage_liked"),
+    InlineKeyboardButton("👎", callback_data="replymessage_disliked"),
+]]))
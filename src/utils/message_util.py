@@ -0,0 +1,30 @@
+from typing import List
+
+from telegram.constants import MessageLimit
+
+# Preferred places to split a long message, best first
+SPLIT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> List[str]:
+    """
+    Splits a text into chunks that fit into a single Telegram message.
+
+    Chunks end at a paragraph, line, sentence or word boundary where possible
+    and only fall back to a hard cut for text without any of them.
+    """
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = 0
+        for separator in SPLIT_SEPARATORS:
+            position = window.rfind(separator)
+            if position > 0:
+                cut = position + len(separator)
+                break
+        if not cut:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    chunks.append(text)
+    return chunks
@@ -0,0 +1,78 @@
+import hmac
+import json
+from typing import Optional
+
+from core.config import settings
+
+try:
+    # Optional (`fast` extra): several times quicker than `json` at decoding updates
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Update fields that carry a message-like object with a `chat`
+MESSAGE_UPDATE_TYPES = ("message", "edited_message", "channel_post", "edited_channel_post",
+                        "business_message", "edited_business_message")
+
+# The updates the handlers of `handlers.build_application` act on: text and voice messages
+# (commands included) and button presses
+HANDLED_UPDATE_TYPES = ("message", "callback_query")
+HANDLED_MESSAGE_FIELDS = ("text", "voice")
+
+# Header in which Telegram echoes the `secret_token` the webhook was registered with
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def is_authentic(secret_token: Optional[str]) -> bool:
+    """Checks the secret token of a webhook request, when `WEBHOOK_SECRET_TOKEN` is set."""
+    if not settings.WEBHOOK_SECRET_TOKEN:
+        return True
+    return secret_token is not None and hmac.compare_digest(secret_token.encode(),
+                                                            settings.WEBHOOK_SECRET_TOKEN.encode())
+
+
+def parse_update(raw_update: bytes) -> Optional[dict]:
+    """Decodes the body of a webhook request, or returns None when it isn't a Telegram update."""
+    try:
+        data = json_loads(raw_update)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+        return None
+    return data
+
+
+def is_handled(data: dict, update_type: Optional[str]) -> bool:
+    """Tells from the raw update whether any handler will act on it, before the `Update` is built."""
+    if update_type not in HANDLED_UPDATE_TYPES:
+        return False
+    if update_type == "message":
+        message = data["message"]
+        return isinstance(message, dict) and any(field in message for field in HANDLED_MESSAGE_FIELDS)
+    return True
+
+
+def get_update_type(data: dict) -> Optional[str]:
+    """Returns the name of the payload field of a raw update, e.g. "message" or "callback_query"."""
+    for key in data:
+        if key != "update_id":
+            return key
+    return None
+
+
+def get_update_chat_id(data: dict) -> Optional[int]:
+    """Returns the chat a raw update belongs to, falling back to the sending user."""
+    update_type = get_update_type(data)
+    payload = data.get(update_type) if update_type else None
+    if not isinstance(payload, dict):
+        return None
+    if update_type in MESSAGE_UPDATE_TYPES:
+        return payload.get("chat", {}).get("id")
+    if update_type == "callback_query":
+        chat_id = (payload.get("message") or {}).get("chat", {}).get("id")
+        if chat_id is not None:
+            return chat_id
+    chat_id = (payload.get("chat") or {}).get("id")
+    if chat_id is not None:
+        return chat_id
+    return (payload.get("from") or payload.get("user") or {}).get("id")
@@ -0,0 +1,52 @@
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+from telegram import Voice
+
+from core.config import settings
+from core.http_client import get_agent_client
+from memory.cache import TTLCache
+
+# file_unique_id -> download URL; forwarded and resent recordings keep their file_unique_id
+voice_file_urls = TTLCache(maxsize=settings.VOICE_FILE_CACHE_SIZE, ttl=settings.VOICE_FILE_CACHE_TTL)
+
+
+async def resolve_voice_url(voice: Optional[Voice]) -> Optional[str]:
+    """Returns the download URL of a voice message, calling getFile only for recordings not seen recently."""
+    if voice is None:
+        return None
+    url = voice_file_urls.get(voice.file_unique_id)
+    if url is None:
+        url = (await voice.get_file()).file_path
+        voice_file_urls.set(voice.file_unique_id, url)
+    return url
+
+
+async def _multipart_upload(body: Dict[str, Any], voice_url: str, boundary: str) -> AsyncIterator[bytes]:
+    for name, value in body.items():
+        if name != "audio" and value is not None:
+            yield f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="audio"; filename="voice.oga"\r\n'
+           f'Content-Type: audio/ogg\r\n\r\n').encode('utf-8')
+    async with get_agent_client().stream("GET", voice_url, timeout=settings.AUDIO_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+def agent_request_content(body: Dict[str, Any], voice_url: Optional[str]) -> Dict[str, Any]:
+    """
+    The httpx arguments that carry an agent request body.
+
+    Normally the body is sent as JSON with the recording's Telegram URL in
+    `audio`. With `AGENT_AUDIO_UPLOAD` a voice question is sent as
+    multipart/form-data instead, the recording streamed from Telegram into the
+    `audio` part as it downloads, so the agent neither fetches it nor sees the
+    bot token in its URL.
+    """
+    if not (settings.AGENT_AUDIO_UPLOAD and voice_url):
+        return {"json": body}
+    boundary = uuid.uuid4().hex
+    return {"content": _multipart_upload(body, voice_url, boundary),
+            "headers": {"Content-Type": f"multipart/form-data; boundary={boundary}"}}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Stream worker for the `stream` webhook ingestion mode.
+
+The webhook server only appends raw updates to a Redis Stream (see
+`WEBHOOK_INGESTION_MODE`). Any number of these workers consume that stream as
+one consumer group, handle each update with the same handlers as the webhook
+server and acknowledge it afterwards. Entries from a worker that died are
+claimed by the remaining ones. Each worker serves its Prometheus metrics on
+`STREAM_WORKER_METRICS_PORT`.
+
+Usage:
+    python src/worker.py
+"""
+import asyncio
+import signal
+
+from telegram import Update
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import bind_queue_gauges, start_metrics_server
+from handlers import build_application, init_resources, close_resources
+from memory.update_stream import UpdateStreamConsumer
+
+
+async def main() -> None:
+    logger.info('################################################')
+    logger.info('# Telegram bot worker %s', settings.TELEGRAM_BOT_NAME)
+    logger.info('################################################')
+    # Handlers block so that an entry is only acknowledged after it was handled
+    application = build_application(block=True)
+    bind_queue_gauges(lambda: application.bot.rate_limiter.queue_depth)
+    if settings.STREAM_WORKER_METRICS_PORT:
+        # Workers don't serve HTTP otherwise, the metrics are scraped from each of them
+        start_metrics_server(settings.STREAM_WORKER_METRICS_PORT)
+
+    async def handle(data: dict) -> None:
+        await application.process_update(Update.de_json(data=data, bot=application.bot))
+
+    consumer = UpdateStreamConsumer(handle)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    async with application:
+        background_tasks = await init_resources(application.bot)
+        await application.start()
+        try:
+            await consumer.run()
+        finally:
+            await application.stop()
+            await close_resources(background_tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
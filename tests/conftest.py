@@ -0,0 +1,8 @@
+import os
+
+# Settings are read when `core.config` is first imported; the tests never reach Telegram, the agent or Redis
+os.environ.setdefault("TELEGRAM_BASE_URL", "http://localhost:8000")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+os.environ.setdefault("TELEGRAM_BOT_NAME", "test_bot")
+os.environ.setdefault("KB_AGENT_BASE_URL", "http://localhost:9")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,83 @@
+import pytest
+
+from core.admission import AdmissionController
+
+
+def build_controller(**kwargs) -> AdmissionController:
+    options = dict(enabled=True, soft_watermark=2, hard_watermark=3, priority_watermark=5)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_an_update_counts_until_every_hold_is_released():
+    admission = build_controller()
+    admission.hold(1)
+    admission.hold(1)
+    admission.hold(2)
+    assert admission.load == 2
+    admission.release(1)
+    assert admission.is_outstanding(1)
+    admission.release(1)
+    assert not admission.is_outstanding(1)
+    assert admission.load == 1
+
+
+def test_queries_are_shed_above_the_soft_watermark():
+    admission = build_controller()
+    admission.hold(1)
+    assert not admission.should_shed()
+    admission.hold(2)
+    assert admission.should_shed()
+
+
+def test_priority_updates_are_admitted_above_the_hard_watermark():
+    admission = build_controller()
+    for update_id in range(3):
+        admission.hold(update_id)
+    assert not admission.admit("message")
+    assert admission.admit("callback_query")
+    assert admission.stats()["rejected"] == 1
+
+
+def test_disabled_controller_admits_everything():
+    admission = build_controller(enabled=False)
+    for update_id in range(10):
+        admission.hold(update_id)
+    assert admission.admit("message")
+    assert not admission.should_shed()
+
+
+@pytest.mark.filterwarnings("ignore:Tasks created via")
+def test_application_holds_an_update_until_its_non_blocking_handler_finished(monkeypatch):
+    import asyncio
+
+    from telegram import Update, User
+    from telegram.ext import Application, TypeHandler
+
+    import handlers
+
+    admission = build_controller()
+    monkeypatch.setattr(handlers, "admission", admission)
+
+    async def scenario():
+        application = Application.builder().application_class(handlers.TrackedApplication).token("0:test") \
+            .updater(None).build()
+        release = asyncio.Event()
+
+        async def slow_handler(update, context):
+            await release.wait()
+
+        application.add_handler(TypeHandler(Update, slow_handler, block=False))
+        # `initialize` would call getMe
+        application.bot._bot_user = User(id=0, first_name="test", is_bot=True)
+        application._initialized = True
+        update = Update(update_id=7)
+        admission.hold(update.update_id)
+        await application.process_update(update)
+        # Dispatched, but the handler task still runs
+        load_while_handling = admission.load
+        release.set()
+        await asyncio.sleep(0.01)
+        return load_while_handling, admission.load
+
+    assert asyncio.run(scenario()) == (1, 0)
@@ -0,0 +1,82 @@
+import asyncio
+
+from core.coordinator import ChatCoordinator
+
+
+class Recorder:
+    """An `answer` callback that logs when each batch starts and ends."""
+
+    def __init__(self, coordinator: ChatCoordinator, chat_id, duration: float, replying: bool = True):
+        self.coordinator = coordinator
+        self.chat_id = chat_id
+        self.duration = duration
+        self.replying = replying
+        self.events = []
+
+    async def __call__(self, batch):
+        if self.replying:
+            self.coordinator.replying(self.chat_id)
+        self.events.append(("start", batch))
+        await asyncio.sleep(self.duration)
+        self.events.append(("end", batch))
+
+
+def test_turns_of_a_chat_run_one_after_another():
+    async def scenario():
+        coordinator = ChatCoordinator(window=0, cancel_superseded=False)
+        recorder = Recorder(coordinator, 1, duration=0.05, replying=False)
+        handlers = []
+        for item in ("a", "b", "c"):
+            handlers.append(asyncio.create_task(coordinator.handle(1, item, recorder)))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*handlers)
+        return recorder.events, coordinator.stats()
+
+    events, stats = asyncio.run(scenario())
+    assert events == [("start", ["a"]), ("end", ["a"]), ("start", ["b"]), ("end", ["b"]),
+                      ("start", ["c"]), ("end", ["c"])]
+    assert stats["chats"] == 0
+
+
+def test_a_waiting_turn_is_superseded_by_the_next_message():
+    async def scenario():
+        coordinator = ChatCoordinator(window=0, cancel_superseded=True)
+        replying = Recorder(coordinator, 1, duration=0.05)
+        await_agent = Recorder(coordinator, 1, duration=0.05, replying=False)
+        first = asyncio.create_task(coordinator.handle(1, "a", replying))
+        await asyncio.sleep(0.01)
+        # Waits for "a", which is replying already, and is then taken along by "c"
+        second = asyncio.create_task(coordinator.handle(1, "b", await_agent))
+        await asyncio.sleep(0.01)
+        third = asyncio.create_task(coordinator.handle(1, "c", await_agent))
+        await asyncio.gather(first, second, third)
+        return replying.events + await_agent.events, coordinator.stats()
+
+    events, stats = asyncio.run(scenario())
+    assert events == [("start", ["a"]), ("end", ["a"]), ("start", ["b", "c"]), ("end", ["b", "c"])]
+    assert stats["cancelled"] == 1 and stats["chats"] == 0
+
+
+def test_a_query_waiting_for_the_agent_is_cancelled_and_asked_again():
+    async def scenario():
+        coordinator = ChatCoordinator(window=0, cancel_superseded=True)
+        recorder = Recorder(coordinator, 1, duration=0.05, replying=False)
+        first = asyncio.create_task(coordinator.handle(1, "a", recorder))
+        await asyncio.sleep(0.01)
+        await coordinator.handle(1, "b", recorder)
+        await first
+        return recorder.events
+
+    assert asyncio.run(scenario()) == [("start", ["a"]), ("start", ["a", "b"]), ("end", ["a", "b"])]
+
+
+def test_messages_within_the_window_are_answered_together():
+    async def scenario():
+        coordinator = ChatCoordinator(window=0.02, cancel_superseded=True)
+        recorder = Recorder(coordinator, 1, duration=0)
+        await asyncio.gather(*(coordinator.handle(1, item, recorder) for item in ("a", "b", "c")))
+        return recorder.events, coordinator.stats()
+
+    events, stats = asyncio.run(scenario())
+    assert events == [("start", ["a", "b", "c"]), ("end", ["a", "b", "c"])]
+    assert stats["coalesced"] == 2
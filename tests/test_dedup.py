@@ -0,0 +1,34 @@
+import asyncio
+
+from core.dedup import UpdateDeduplicator
+
+
+def test_a_seen_update_is_a_duplicate():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(window=10)
+        return [await deduplicator.is_duplicate(update_id) for update_id in (1, 2, 1)]
+
+    assert asyncio.run(scenario()) == [False, False, True]
+
+
+def test_old_updates_leave_the_window():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(window=2)
+        for update_id in (1, 2, 3):
+            await deduplicator.is_duplicate(update_id)
+        return await deduplicator.is_duplicate(1), await deduplicator.is_duplicate(3)
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_a_forgotten_update_is_let_through_again():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(window=2)
+        await deduplicator.is_duplicate(1)
+        await deduplicator.forget(1)
+        let_through = not await deduplicator.is_duplicate(1)
+        # The forgotten slot doesn't evict the update now in it
+        await deduplicator.is_duplicate(2)
+        return let_through, await deduplicator.is_duplicate(1), deduplicator.stats()["hits"]
+
+    assert asyncio.run(scenario()) == (True, True, 1)
@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import handlers
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+        return SimpleNamespace(message_id=len(self.sent))
+
+
+class FakeAnswerCache:
+    def __init__(self):
+        self.stored = []
+
+    def cache_key(self, query, language):
+        return query
+
+    async def get(self, key):
+        return None
+
+    async def set(self, key, answer):
+        self.stored.append((key, answer))
+
+
+def build_update() -> SimpleNamespace:
+    chat = SimpleNamespace(id=1, first_name="test")
+    return SimpleNamespace(effective_chat=chat, message=SimpleNamespace(id=1, from_user=SimpleNamespace(id=1)))
+
+
+def test_an_empty_streamed_answer_is_answered_with_the_error_message(monkeypatch):
+    async def events(url, content):
+        for text in ("", " ", "\n"):
+            yield {"text": text}
+
+    cache = FakeAnswerCache()
+    monkeypatch.setattr(handlers.settings, "AGENT_STREAMING_ENABLED", True)
+    monkeypatch.setattr(handlers, "iter_agent_events", events)
+    monkeypatch.setattr(handlers, "answer_cache", cache)
+    monkeypatch.setattr(handlers, "get_message", lambda language, key: f"{language}.{key}")
+    bot = FakeBot()
+    context = SimpleNamespace(bot=bot)
+
+    asyncio.run(handlers.handle_query_response(build_update(), context, "hi", None, "en"))
+    assert bot.sent == [{"chat_id": 1, "text": "en.context_error_msg"}]
+    assert cache.stored == []
+
+
+def test_keyboards_are_sent_as_they_were_built():
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+    from utils.markup_util import markups
+
+    bot = FakeBot()
+    asyncio.run(handlers.language_handler(build_update(), SimpleNamespace(bot=bot)))
+    assert bot.sent[0]["reply_markup"] is markups.get("language")
+    assert markups.render("feedback", 42) == InlineKeyboardMarkup([[
+        InlineKeyboardButton("👍🏻", callback_data="message-liked__42"),
+        InlineKeyboardButton("👎🏻", callback_data="message-disliked__42"),
+    ]])
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from core.rate_limiter import Priority, PriorityRateLimiter, TokenBucket
+
+
+def build_limiter(**kwargs) -> PriorityRateLimiter:
+    options = dict(global_rate=20, chat_rate=100, chat_burst=100, group_rate_per_minute=6000, max_retries=2,
+                   bulk_reserve=0)
+    options.update(kwargs)
+    return PriorityRateLimiter(**options)
+
+
+async def send(limiter: PriorityRateLimiter, sent: list, name: str, chat_id, priority=None, endpoint="sendMessage"):
+    async def callback():
+        sent.append(name)
+        return True
+
+    data = {"chat_id": chat_id} if chat_id is not None else {}
+    return await limiter.process_request(callback, (), {}, endpoint, data, priority)
+
+
+def test_token_bucket_keeps_the_reserve():
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert bucket.try_acquire(reserve=1) == 0.0
+    assert bucket.try_acquire(reserve=1) == 0.0
+    # One token left, which is the reserve
+    assert bucket.try_acquire(reserve=1) > 0
+    assert bucket.try_acquire() == 0.0
+
+
+def test_queued_requests_are_sent_in_priority_order():
+    async def scenario():
+        limiter = build_limiter()
+        await limiter.initialize()
+        limiter._global_bucket.tokens = 0
+        sent = []
+        await asyncio.gather(
+            send(limiter, sent, "bulk", 1, Priority.BULK),
+            send(limiter, sent, "typing", 2, endpoint="sendChatAction"),
+            send(limiter, sent, "feedback", 3, Priority.FEEDBACK),
+            send(limiter, sent, "answer", 4),
+        )
+        await limiter.shutdown()
+        return sent
+
+    assert asyncio.run(scenario()) == ["answer", "feedback", "typing", "bulk"]
+
+
+def test_retry_after_pauses_every_request_and_retries():
+    async def scenario():
+        limiter = build_limiter()
+        await limiter.initialize()
+        sent = []
+        attempts = 0
+
+        async def flooded():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise RetryAfter(1)
+            return True
+
+        started_at = time.monotonic()
+        first = asyncio.create_task(limiter.process_request(flooded, (), {}, "sendMessage", {"chat_id": 1}, None))
+        await asyncio.sleep(0.1)
+        # Another chat's request queued during the pause waits for it as well
+        await send(limiter, sent, "other", 2)
+        other_at = time.monotonic() - started_at
+        assert await first is True
+        await limiter.shutdown()
+        return attempts, other_at, limiter.stats()
+
+    attempts, other_at, stats = asyncio.run(scenario())
+    assert attempts == 2
+    assert other_at >= 0.9
+    assert stats["retry_after"] == 1
+
+
+def test_retry_after_is_raised_once_retries_are_exhausted():
+    async def scenario():
+        limiter = build_limiter(max_retries=0)
+        await limiter.initialize()
+
+        async def flooded():
+            raise RetryAfter(1)
+
+        try:
+            await limiter.process_request(flooded, (), {}, "sendMessage", {"chat_id": 1}, None)
+        finally:
+            await limiter.shutdown()
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(scenario())
+
+
+def test_requests_without_chat_are_not_counted_as_answers():
+    async def scenario():
+        limiter = build_limiter()
+        await limiter.initialize()
+        sent = []
+        await send(limiter, sent, "get_me", None, endpoint="getMe")
+        await send(limiter, sent, "answer", 1)
+        await limiter.shutdown()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["unthrottled"] == 1
+    assert stats["priorities"]["answer"]["sent"] == 1
@@ -0,0 +1,186 @@
+import asyncio
+
+import httpx
+import pytest
+
+from core import resilience
+from core.resilience import (AdaptiveConcurrencyLimiter, BackendGuard, CircuitBreaker, CircuitOpenError,
+                             CircuitState)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def build_limiter(**kwargs) -> AdaptiveConcurrencyLimiter:
+    options = dict(initial_limit=4, min_limit=1, max_limit=100, target_latency=1, backoff=0.5, queue_timeout=1)
+    options.update(kwargs)
+    return AdaptiveConcurrencyLimiter(**options)
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_after_the_timeout(clock):
+    breaker = CircuitBreaker("agent", failure_threshold=2, reset_timeout=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.state == CircuitState.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_a_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("agent", failure_threshold=1, reset_timeout=10)
+    breaker.allow()
+    breaker.record(False)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitState.OPEN
+    clock.now += 5
+    assert not breaker.allow()
+    assert breaker.stats()["times_opened"] == 2
+
+
+def test_a_success_resets_the_failure_count():
+    breaker = CircuitBreaker("agent", failure_threshold=2, reset_timeout=10)
+    for success in (False, True, False):
+        breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_limit_grows_by_one_per_success_until_the_first_failure():
+    async def scenario():
+        limiter = build_limiter()
+        for _ in range(4):
+            await limiter.acquire()
+        # Each finished call is followed by another, so the limit stays in use
+        for _ in range(4):
+            limiter.release(0.1, True)
+            await limiter.acquire()
+        return limiter.limit
+
+    assert asyncio.run(scenario()) == 8
+
+
+def test_limit_backs_off_then_grows_additively():
+    async def scenario():
+        limiter = build_limiter(initial_limit=8)
+        for _ in range(8):
+            await limiter.acquire()
+        # Too slow, counts as a failure
+        limiter.release(2, True)
+        backed_off = limiter.limit
+        limiter.release(0.1, True)
+        return backed_off, limiter.limit, limiter.slow_start_threshold
+
+    backed_off, grown, threshold = asyncio.run(scenario())
+    assert backed_off == threshold == 4
+    assert grown == pytest.approx(4.25)
+
+
+def test_limit_stays_when_it_is_not_reached():
+    async def scenario():
+        limiter = build_limiter(initial_limit=10)
+        await limiter.acquire()
+        limiter.release(0.1, True)
+        return limiter.limit
+
+    assert asyncio.run(scenario()) == 10
+
+
+def test_guard_counts_server_errors_but_not_client_errors_or_cancellation(clock):
+    breaker = CircuitBreaker("agent", failure_threshold=1, reset_timeout=10)
+    guard = BackendGuard(breaker, build_limiter())
+
+    def status_error(status_code: int) -> httpx.HTTPStatusError:
+        request = httpx.Request("POST", "http://agent")
+        return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status_code, request=request))
+
+    async def call(exc: BaseException) -> None:
+        async with guard.call():
+            raise exc
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await call(status_error(400))
+        with pytest.raises(asyncio.CancelledError):
+            await call(asyncio.CancelledError())
+        closed_after_client_errors = breaker.state
+        with pytest.raises(httpx.HTTPStatusError):
+            await call(status_error(502))
+        with pytest.raises(CircuitOpenError):
+            await call(RuntimeError())
+        return closed_after_client_errors, guard.limiter.in_flight
+
+    assert asyncio.run(scenario()) == (CircuitState.CLOSED, 0)
+
+
+def test_a_cancelled_waiter_gives_its_slot_back():
+    async def scenario():
+        limiter = build_limiter(initial_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release(0.1, None)
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+
+def test_telegram_errors_while_streaming_do_not_count_against_the_agent(monkeypatch):
+    from types import SimpleNamespace
+
+    from telegram.error import NetworkError
+
+    import handlers
+
+    guard = BackendGuard(CircuitBreaker("agent", failure_threshold=1, reset_timeout=10), build_limiter())
+    monkeypatch.setattr(handlers, "agent_guard", guard)
+
+    async def events(url, content):
+        for text in ("Hello", " world"):
+            yield {"text": text}
+
+    async def send_message(**kwargs):
+        raise NetworkError("Telegram is down")
+
+    async def no_cached_answer(*args):
+        return None, None
+
+    monkeypatch.setattr(handlers, "iter_agent_events", events)
+    monkeypatch.setattr(handlers, "get_cached_answer", no_cached_answer)
+    chat = SimpleNamespace(id=1, first_name="test")
+    update = SimpleNamespace(effective_chat=chat, message=SimpleNamespace(from_user=SimpleNamespace(id=1)))
+    context = SimpleNamespace(bot=SimpleNamespace(send_message=send_message))
+
+    async def scenario():
+        with pytest.raises(NetworkError):
+            await handlers.stream_query_response("hi", None, "en", update, context)
+        await asyncio.sleep(0)
+        return guard.breaker.state, guard.limiter.in_flight
+
+    assert asyncio.run(scenario()) == (CircuitState.CLOSED, 0)